@@ -0,0 +1,364 @@
+'''
+
+Benchmarks of the audio path that run without audio hardware or Qt.
+
+    python3 bench.py alloc      allocations per block in the relay, stages and mixer
+    python3 bench.py idle       power-save resume latency and idle CPU
+    python3 bench.py mixer      cost of mixing N inputs to M outputs
+    python3 bench.py duck       time per block of the voice ducker
+    python3 bench.py convert    throughput of sample format conversion
+
+Stand-in devices take the place of the QIODevices that Qt gives the
+relay. The stand-in source returns one prepared bytes object over and
+over, so that what is measured is the relay itself and not the bytes
+object that PyQt5 creates for every read.
+
+'''
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+from convert import (
+    ALL_FORMATS, INT16, SampleConverter, SampleFormat, block_dtype,
+    sample_bytes
+)
+from idle import IdleSuspender, SILENT
+from mixer import RouteMixer
+from relay import Block, BlockRelay
+from vad import VoiceDucker
+
+# The block size used by the app, see sidetone.py
+BLOCK_BYTES = 384
+
+# Stand-in for the QIODevice of a QAudioInput in push mode. Each call to
+# relay() finds "chunks" reads of "chunk_bytes" bytes waiting, then an
+# empty read, as when Qt has drained its buffer.
+
+# The audio is loud noise unless silent is True.
+
+class StandInSource( object ) :
+    def __init__( self, chunk_bytes, chunks=1, silent=False ) :
+        self.chunk = bytes( range( 256 ) ) * ( chunk_bytes // 256 + 1 )
+        self.chunk = self.chunk[ : chunk_bytes ]
+        if silent :
+            self.chunk = bytes( chunk_bytes )
+        self.empty = b''
+        self.chunks = chunks
+        self.waiting = chunks
+    def read( self, max_bytes ) :
+        if self.waiting == 0 :
+            self.waiting = self.chunks
+            return self.empty
+        self.waiting -= 1
+        return self.chunk if max_bytes >= len( self.chunk ) \
+                          else self.chunk[ : max_bytes ]
+
+# Stand-in for the QIODevice of a QAudioOutput in push mode.
+
+class StandInSink( object ) :
+    def __init__( self ) :
+        self.written = 0
+    def write( self, data ) :
+        self.written += len( data )
+        return len( data )
+
+# Call step() "blocks" times, after a warm-up so that one-time costs are
+# not counted, and return (bytes retained at the end, average transient
+# bytes per block). The transient bytes of a call are its peak above
+# where it started.
+
+def measure( blocks, step ) :
+    for i in range( 100 ) :
+        step()
+    gc.collect()
+    tracemalloc.start()
+    base, peak = tracemalloc.get_traced_memory()
+    transient = 0
+    for i in range( blocks ) :
+        before, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        step()
+        after, peak = tracemalloc.get_traced_memory()
+        transient += peak - before
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current - base, transient / blocks
+
+# Measure the relay with the given stages.
+
+def measure_relay( blocks, stages=() ) :
+    relay = BlockRelay( StandInSource( BLOCK_BYTES ), StandInSink(), BLOCK_BYTES )
+    for name, stage in stages :
+        relay.add_stage( name, stage )
+    return measure( blocks, relay.relay )
+
+# A stage that makes a new array for every block, as a processing step
+# written without care would, to show what the benchmark catches.
+
+def careless_stage( block ) :
+    samples = numpy.frombuffer( bytes( block.data ), dtype=numpy.int16 )
+    block.samples[:] = samples // 2
+    return block
+
+# Note that CPython makes a new int object for any result above 256, and
+# the relay has to take len() of what it reads, so a few dozen transient
+# bytes per block are counted even for the relay alone. They come from
+# and go back to the small-object allocator's free lists, and ints are
+# not tracked by the garbage collector. The stages add a little more of
+# the same, and the dither of a SampleConverter some for the random
+# numbers, but a stage that copies the block, as bytes or as an array,
+# makes at least a block's worth; so the limit is one block.
+ALLOC_LIMIT = BLOCK_BYTES
+
+# The stages reconnect_devices() in sidetone.py puts in the relay, with
+# ducking on, without and with sample format conversion (from 24-bit
+# input, which is dithered, to 32-bit float output, see convert.py).
+
+def app_stages( convert=False ) :
+    idle = IdleSuspender( lambda state : None, lambda : None )
+    ducker = VoiceDucker()
+    ducker.configure( 48000, 1 )
+    ducker.enabled = True
+    ducker.level = 0.8
+    stages = [ ( 'level', idle.stage ), ( 'duck', ducker.stage ) ]
+    if convert :
+        in_sample = SampleFormat( 24, 'int', True )
+        ot_sample = SampleFormat( 32, 'float', True )
+        samples = BLOCK_BYTES // sample_bytes( in_sample )
+        stages.insert( 0, ( 'convert in', SampleConverter(
+            in_sample, INT16, samples ).stage ) )
+        stages.append( ( 'convert out', SampleConverter(
+            INT16, ot_sample, samples ).stage ) )
+    return stages
+
+# The relay with each set of stages, and the mixer at its smallest and
+# largest, each with the size of its block as the limit.
+
+def alloc_cases() :
+    def relay_case( stages ) :
+        return lambda blocks : measure_relay( blocks, stages )
+    def mixer_case( size ) :
+        return lambda blocks : measure( blocks, mixer_step( size ) )
+    return [
+        ( 'none', relay_case( () ), ALLOC_LIMIT ),
+        ( 'app', relay_case( app_stages() ), ALLOC_LIMIT ),
+        ( 'convert', relay_case( app_stages( convert=True ) ), ALLOC_LIMIT ),
+        ( 'mixer 1x1', mixer_case( 1 ), PLANNED_BLOCK_BYTES ),
+        ( 'mixer 8x8', mixer_case( 8 ), PLANNED_BLOCK_BYTES ),
+        ( 'careless', relay_case( ( ( 'careless', careless_stage ), ) ), None ),
+    ]
+
+def bench_alloc( args ) :
+    print( '{:>10} {:>8} {:>14} {:>16}'.format(
+        'stages', 'blocks', 'bytes retained', 'transient/block' ) )
+    steady = True
+    for label, run, limit in alloc_cases() :
+        results = [
+            ( blocks, ) + run( blocks ) for blocks in ( 1000, 10000, 100000 )
+        ]
+        for blocks, retained, transient in results :
+            print( '{:>10} {:>8} {:>14} {:>16.1f}'.format(
+                label, blocks, retained, transient ) )
+        if limit is not None :
+            # Steady state allocates nothing per block if the memory
+            # retained does not grow with the number of blocks (a few
+            # bytes are always counted, e.g. for the loop counter), and no
+            # block-sized object is made and dropped for each block.
+            first, last = results[0], results[-1]
+            if last[1] > first[1] \
+               or any( result[2] >= limit for result in results ) :
+                steady = False
+                print( '{:>10} allocates per block'.format( label ) )
+    print( 'steady state of the relay, the app\'s stages and the mixer '
+           'allocates nothing per block:', steady )
+    return 0 if steady else 1
+
+# Blocks per second for a 48 kHz mono 16-bit stream, as the idle CPU is
+# figured at that rate.
+BLOCKS_PER_SEC = 48000 * 2 / BLOCK_BYTES
+
+# While suspended for silence the input keeps running and each block is
+# measured, so the idle CPU is the cost of relaying a silent block through
+# the level stage to the held output. Resume latency here is the time from
+# a loud block reaching the relay until the devices are told to resume;
+# the device's own restart time comes on top and is shown by the app in
+# its status bar after each resume.
+
+def bench_idle( args ) :
+    resumed = []
+    suspender = IdleSuspender(
+        lambda state : None,
+        lambda : resumed.append( time.perf_counter() ),
+        idle_secs=0.001 )
+    quiet = BlockRelay( StandInSource( BLOCK_BYTES, silent=True ),
+                        StandInSink(), BLOCK_BYTES )
+    loud = BlockRelay( StandInSource( BLOCK_BYTES ),
+                       StandInSink(), BLOCK_BYTES )
+    for relay in ( quiet, loud ) :
+        relay.add_stage( 'level', suspender.stage )
+    # CPU per silent block while suspended.
+    suspender.loud_at -= 1.0
+    suspender.tick()
+    assert suspender.state == SILENT
+    quiet.hold()
+    blocks = 20000
+    cpu = time.process_time()
+    for i in range( blocks ) :
+        quiet.relay()
+    cpu = ( time.process_time() - cpu ) / blocks
+    # Resume latency, over many suspensions.
+    latencies = []
+    for i in range( 1000 ) :
+        suspender.suspend( SILENT )
+        start = time.perf_counter()
+        loud.relay()
+        latencies.append( 1e6 * ( resumed[-1] - start ) )
+    latencies.sort()
+    print( 'idle CPU per silent block:     {:8.2f} us'.format( cpu * 1e6 ) )
+    print( 'idle CPU at {:.0f} blocks/s:     {:8.3f} %'.format(
+        BLOCKS_PER_SEC, 100.0 * cpu * BLOCKS_PER_SEC ) )
+    print( 'resume latency median:         {:8.2f} us'.format(
+        latencies[ len( latencies ) // 2 ] ) )
+    print( 'resume latency max:            {:8.2f} us'.format( latencies[-1] ) )
+    return 0
+
+# The block size planned for 48 kHz mono (see formats.py), and how long
+# such a block lasts.
+
+PLANNED_BLOCK_BYTES = 212
+PLANNED_BLOCK_SECS = PLANNED_BLOCK_BYTES / 2 / 48000
+
+# A mixer of "size" inputs to as many outputs with every route live, and
+# a function that relays one block of the planned size through it: one
+# read from every input, the mix, and one write to every output. The
+# other inputs are read first, so the first one's block finds a block
+# waiting in each of them.
+
+def mixer_step( size ) :
+    mixer = RouteMixer(
+        [ StandInSource( PLANNED_BLOCK_BYTES ) for i in range( size ) ],
+        [ StandInSink() for i in range( size ) ],
+        PLANNED_BLOCK_BYTES )
+    mixer.set_gains( numpy.full( ( size, size ), 1.0 / size ) )
+    order = list( range( size - 1, -1, -1 ) )
+    def step() :
+        for index in order :
+            mixer.relay( index )
+    return step
+
+# Time the mixer at sizes up to 8 by 8. The cost is given as a fraction
+# of the time the block lasts, so anything well under 1.0 runs in real
+# time on one core.
+
+def bench_mixer( args ) :
+    print( '{:>6} {:>14} {:>12}'.format( 'routes', 'us per block', 'real time' ) )
+    worst = 0.0
+    for size in ( 1, 2, 4, 8 ) :
+        step = mixer_step( size )
+        blocks = 5000
+        start = time.perf_counter()
+        for i in range( blocks ) :
+            step()
+        per_block = ( time.perf_counter() - start ) / blocks
+        fraction = per_block / PLANNED_BLOCK_SECS
+        worst = max( worst, fraction )
+        print( '{:>6} {:>14.1f} {:>12.3f}'.format(
+            '{}x{}'.format( size, size ), per_block * 1e6, fraction ) )
+    return 0 if worst < 1.0 else 1
+
+# Time the VoiceDucker on blocks of the planned size for 48 kHz mono, of
+# hiss (judged and ducked), a tone (judged speech, gain steady) and the
+# two alternating (the gain ramping all the time). The worst block is
+# what bounds the cost, so that is shown along with the median.
+
+def bench_duck( args ) :
+    ducker = VoiceDucker()
+    ducker.configure( 48000, 1 )
+    ducker.enabled = True
+    ducker.level = 0.8
+    block = Block( PLANNED_BLOCK_BYTES, numpy.int16 )
+    frames = block.samples.shape[0]
+    hiss = numpy.random.default_rng( 1 ).normal( 0, 300, frames ) \
+                .astype( numpy.int16 )
+    tone = ( 8000 * numpy.sin( numpy.arange( frames ) * 0.03 ) ) \
+                .astype( numpy.int16 )
+    print( '{:>10} {:>12} {:>12} {:>10}'.format(
+        'input', 'median us', 'worst us', 'of block' ) )
+    worst_all = 0.0
+    for label, pattern in ( ( 'hiss', [ hiss ] ), ( 'tone', [ tone ] ),
+                            ( 'switching', [ tone ] * 5 + [ hiss ] * 200 ) ) :
+        times = []
+        for i in range( 20000 ) :
+            block.samples[:] = pattern[ i % len( pattern ) ]
+            start = time.perf_counter()
+            ducker.stage( block )
+            times.append( time.perf_counter() - start )
+        times.sort()
+        worst = times[-1]
+        worst_all = max( worst_all, times[ len( times ) * 999 // 1000 ] )
+        print( '{:>10} {:>12.2f} {:>12.2f} {:>9.1f}%'.format(
+            label, 1e6 * times[ len( times ) // 2 ], 1e6 * worst,
+            100.0 * worst / PLANNED_BLOCK_SECS ) )
+    return 0 if worst_all < PLANNED_BLOCK_SECS else 1
+
+# Time the SampleConverter from every format to INT16, as at the start of
+# the relay, and from INT16 to every format, as at the end, on blocks of
+# the planned duration in stereo, the most a preferred format is likely
+# to be. Each is given in millions of samples a second and as a fraction
+# of the time the block lasts.
+
+def bench_convert( args ) :
+    samples = PLANNED_BLOCK_BYTES // 2 * 2
+    noise = numpy.random.default_rng( 1 ).normal( 0, 3000, samples ) \
+                 .astype( numpy.int16 )
+    print( '{:>18} {:>6} {:>10} {:>10} {:>10}'.format(
+        'format', 'way', 'us/block', 'Msamp/s', 'real time' ) )
+    worst = 0.0
+    for sample_format in ALL_FORMATS :
+        name = '{}-bit {} {}'.format(
+            sample_format.bits, sample_format.kind,
+            'LE' if sample_format.little else 'BE' )
+        # A block of the noise in this format, made by the converter.
+        block = Block( samples * 2, numpy.int16 )
+        block.samples[:] = noise
+        made = SampleConverter( INT16, sample_format, samples ).stage( block )
+        source = Block( samples * sample_bytes( sample_format ),
+                        block_dtype( sample_format ) )
+        source.data[:] = made.data
+        for way, converter, block in (
+                ( 'in', SampleConverter( sample_format, INT16, samples ), source ),
+                ( 'out', SampleConverter( INT16, sample_format, samples ), block ) ) :
+            blocks = 20000
+            start = time.perf_counter()
+            for i in range( blocks ) :
+                converter.stage( block )
+            per_block = ( time.perf_counter() - start ) / blocks
+            fraction = per_block / PLANNED_BLOCK_SECS
+            worst = max( worst, fraction )
+            print( '{:>18} {:>6} {:>10.2f} {:>10.1f} {:>10.3f}'.format(
+                name, way, per_block * 1e6, samples / per_block / 1e6,
+                fraction ) )
+    return 0 if worst < 1.0 else 1
+
+def main() :
+    parser = argparse.ArgumentParser( description='Sidetone benchmarks' )
+    commands = parser.add_subparsers( dest='command', required=True )
+    commands.add_parser( 'alloc', help='allocations per block in the relay and mixer' ) \
+        .set_defaults( run=bench_alloc )
+    commands.add_parser( 'idle', help='power-save resume latency and idle CPU' ) \
+        .set_defaults( run=bench_idle )
+    commands.add_parser( 'mixer', help='cost of mixing N inputs to M outputs' ) \
+        .set_defaults( run=bench_mixer )
+    commands.add_parser( 'duck', help='time per block of the voice ducker' ) \
+        .set_defaults( run=bench_duck )
+    commands.add_parser( 'convert', help='throughput of sample format conversion' ) \
+        .set_defaults( run=bench_convert )
+    args = parser.parse_args()
+    return args.run( args )
+
+if __name__ == '__main__' :
+    sys.exit( main() )
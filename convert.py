@@ -0,0 +1,256 @@
+'''
+
+Convert blocks of audio between sample formats.
+
+A sample format is the size of a sample in bits (8, 16, 24 or 32), its
+kind (signed int, unsigned int or float, as in QAudioFormat.SampleType)
+and its byte order. 24-bit samples are packed, three bytes each.
+
+The relay and its stages work in INT16, 16-bit signed little-endian. When
+a device cannot use that (see formats.py), a SampleConverter stage at the
+start of the relay converts the input to INT16, and another at the end
+converts INT16 to the output's format. A SampleConverter does the least
+work the formats allow:
+
+  * the same format: the block is passed on as it is;
+  * the same size and kind in the other byte order: one copy, NumPy
+    swapping the bytes as it goes;
+  * otherwise, one pass from the source samples, viewed in place as a
+    NumPy array of their own type, into an array of floats scaled to
+    +/-1.0, and one pass from that to the target samples.
+
+When the target has fewer bits than the source (a float source counts as
+24 bits) the target is dithered with triangular noise of one least bit,
+so the lost bits become a little steady hiss rather than distortion.
+
+As in the relay, the arrays, including the views of the relay's blocks,
+are made once; the relay has only a few blocks, so a view of each is
+made the first time it is seen and kept. Nothing the garbage collector
+tracks is made per block, and the casts are kept to those NumPy does
+without a scratch buffer of its own. See bench.py for the allocations
+and the throughput of each format.
+
+'''
+from collections import namedtuple
+
+import numpy
+
+from relay import Block
+
+# The size in bits, the kind ('int', 'uint' or 'float'), and whether the
+# bytes are little-endian.
+SampleFormat = namedtuple( 'SampleFormat', [ 'bits', 'kind', 'little' ] )
+
+# The format the relay works in.
+INT16 = SampleFormat( 16, 'int', True )
+
+# Every format there is: 8-bit samples have no byte order, floats are
+# only 32-bit.
+ALL_FORMATS = [ SampleFormat( 8, 'int', True ), SampleFormat( 8, 'uint', True ) ] + [
+    SampleFormat( bits, kind, little )
+    for bits in ( 16, 24, 32 ) for kind in ( 'int', 'uint' )
+    for little in ( True, False )
+] + [ SampleFormat( 32, 'float', True ), SampleFormat( 32, 'float', False ) ]
+
+def sample_bytes( sample_format ) :
+    return sample_format.bits // 8
+
+# The NumPy dtype of a format, or None for packed 24-bit which has none.
+def numpy_dtype( sample_format ) :
+    if sample_format.bits == 24 :
+        return None
+    code = { 'int' : 'i', 'uint' : 'u', 'float' : 'f' }[ sample_format.kind ]
+    order = '<' if sample_format.little else '>'
+    return numpy.dtype( order + code + str( sample_format.bits // 8 ) )
+
+# The dtype for the samples of a Block holding a format: its own, or
+# for packed 24-bit, bytes.
+def block_dtype( sample_format ) :
+    return numpy_dtype( sample_format ) or numpy.uint8
+
+# The value of full scale, and the value of silence, of integer formats.
+def int_scale( sample_format ) :
+    half = 2 ** ( sample_format.bits - 1 )
+    return half, ( half if sample_format.kind == 'uint' else 0 )
+
+# Bits of real precision, for deciding when to dither.
+def precision( sample_format ) :
+    return 24 if sample_format.kind == 'float' else sample_format.bits
+
+class SampleConverter( object ) :
+    def __init__( self, source, target, samples ) :
+        self.source = source
+        self.target = target
+        self.samples = samples
+        # The block passed on, holding the target samples.
+        self.out = Block( samples * sample_bytes( target ),
+                          block_dtype( target ) )
+        # Views of the relay's blocks, by block, made as each is first seen.
+        self.views = {}
+        if target.bits == 24 :
+            self.out_columns = self.columns( self.out.data, target )
+        self.dither = False
+        if source == target :
+            self.convert = self.same
+            return
+        if ( source.bits, source.kind ) == ( target.bits, target.kind ) :
+            self.convert = self.swap
+            return
+        self.convert = self.general
+        # Floats to work in; 32-bit ints need more than float32 holds.
+        wide = any( sample_format.bits == 32 and sample_format.kind != 'float'
+                    for sample_format in ( source, target ) )
+        self.work_dtype = numpy.float64 if wide else numpy.float32
+        self.work = numpy.zeros( samples, dtype=self.work_dtype )
+        # The numbers used on every block, as NumPy arrays, because a
+        # Python number passed to NumPy becomes a new array every time.
+        def constant( value, dtype=self.work_dtype ) :
+            return numpy.array( value, dtype=dtype )
+        if source.kind != 'float' :
+            scale, offset = int_scale( source )
+            self.in_offset = constant( offset ) if offset else None
+            self.in_scale = constant( 1.0 / scale )
+        if target.kind != 'float' :
+            scale, offset = int_scale( target )
+            self.out_offset = constant( offset ) if offset else None
+            self.out_scale = constant( scale )
+            self.out_low = constant( -scale )
+            self.out_high = constant( scale - 1 )
+        # Samples in the other byte order are swapped into, or out of,
+        # an array of the same type in machine order, as NumPy casts them
+        # to or from floats only through a buffer it makes every time.
+        self.native_in = self.native( source )
+        self.native_out = self.native( target )
+        # Packed 24-bit samples are put together or taken apart in ints,
+        # a byte at a time, each byte copied to ints before it is used.
+        if 24 in ( source.bits, target.bits ) :
+            self.ints = numpy.zeros( samples, dtype=numpy.int32 )
+            self.byte = numpy.zeros( samples, dtype=numpy.int32 )
+            self.byte_bits = constant( 8, numpy.int32 )
+            self.sign_bit = constant( 0x800000, numpy.int32 )
+        # Triangular dither noise is the difference of two uniform noises,
+        # drawn together in one call.
+        self.dither = target.kind != 'float' \
+                      and target.bits < precision( source )
+        if self.dither :
+            self.random = numpy.random.default_rng()
+            self.noise = numpy.zeros( ( 2, samples ), dtype=self.work_dtype )
+            self.noise_up, self.noise_down = self.noise
+
+    # Relay stage: convert the block, returning the converted block.
+    def stage( self, block ) :
+        return self.convert( block )
+
+    # An array of samples in machine byte order for a format whose byte
+    # order is not, else None.
+    def native( self, sample_format ) :
+        dtype = numpy_dtype( sample_format )
+        if dtype is None or dtype.isnative :
+            return None
+        return numpy.zeros( self.samples, dtype=dtype.newbyteorder( '=' ) )
+
+    # Views of the low, middle and high bytes of packed 24-bit samples.
+    def columns( self, data, sample_format ) :
+        rows = numpy.frombuffer( data, dtype=numpy.uint8 ).reshape( -1, 3 )
+        order = ( 0, 1, 2 ) if sample_format.little else ( 2, 1, 0 )
+        return [ rows[ :, column ] for column in order ]
+
+    # Make or find the view of a block's bytes as source samples: an array
+    # of the source dtype, or for 24-bit, the columns of its bytes.
+    def view( self, block ) :
+        view = self.views.get( block )
+        if view is None :
+            dtype = numpy_dtype( self.source )
+            if dtype is None :
+                view = self.columns( block.data, self.source )
+            else :
+                view = numpy.frombuffer( block.data, dtype=dtype )
+            self.views[ block ] = view
+        return view
+
+    def same( self, block ) :
+        return block
+
+    def swap( self, block ) :
+        view = self.view( block )
+        if self.source.bits == 24 :
+            for column, out_column in zip( view, self.out_columns ) :
+                numpy.copyto( out_column, column )
+        else :
+            numpy.copyto( self.out.samples, view )
+        return self.out
+
+    def general( self, block ) :
+        self.decode( self.view( block ) )
+        self.encode()
+        return self.out
+
+    # Source samples to self.work, scaled to +/-1.0.
+
+    def decode( self, view ) :
+        work = self.work
+        source = self.source
+        if self.native_in is not None :
+            numpy.copyto( self.native_in, view )
+            view = self.native_in
+        if source.kind == 'float' :
+            numpy.copyto( work, view, casting='unsafe' )
+            return
+        if source.bits == 24 :
+            ints = self.ints
+            byte = self.byte
+            low, middle, high = view
+            numpy.copyto( ints, high )
+            numpy.left_shift( ints, self.byte_bits, out=ints )
+            numpy.copyto( byte, middle )
+            numpy.bitwise_or( ints, byte, out=ints )
+            numpy.left_shift( ints, self.byte_bits, out=ints )
+            numpy.copyto( byte, low )
+            numpy.bitwise_or( ints, byte, out=ints )
+            if source.kind == 'int' :
+                # Extend the sign of bit 23 through the upper byte.
+                numpy.bitwise_xor( ints, self.sign_bit, out=ints )
+                numpy.subtract( ints, self.sign_bit, out=ints )
+            view = ints
+        numpy.copyto( work, view, casting='unsafe' )
+        if self.in_offset is not None :
+            numpy.subtract( work, self.in_offset, out=work )
+        numpy.multiply( work, self.in_scale, out=work )
+
+    # Cast the work to target samples in self.out.
+
+    def put( self, work ) :
+        if self.native_out is None :
+            numpy.copyto( self.out.samples, work, casting='unsafe' )
+        else :
+            numpy.copyto( self.native_out, work, casting='unsafe' )
+            numpy.copyto( self.out.samples, self.native_out )
+
+    # self.work to target samples in self.out, dithered if need be.
+
+    def encode( self ) :
+        work = self.work
+        target = self.target
+        if target.kind == 'float' :
+            self.put( work )
+            return
+        numpy.multiply( work, self.out_scale, out=work )
+        if self.dither :
+            self.random.random( out=self.noise, dtype=self.work_dtype )
+            numpy.add( work, self.noise_up, out=work )
+            numpy.subtract( work, self.noise_down, out=work )
+        numpy.rint( work, out=work )
+        numpy.maximum( work, self.out_low, out=work )
+        numpy.minimum( work, self.out_high, out=work )
+        if self.out_offset is not None :
+            numpy.add( work, self.out_offset, out=work )
+        if target.bits != 24 :
+            self.put( work )
+            return
+        # Take the int apart into three bytes, low byte first. Casting to
+        # uint8 keeps the low 8 bits, even of a negative number.
+        ints = self.ints
+        numpy.copyto( ints, work, casting='unsafe' )
+        for column in self.out_columns :
+            numpy.copyto( column, ints, casting='unsafe' )
+            numpy.right_shift( ints, self.byte_bits, out=ints )
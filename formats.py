@@ -0,0 +1,230 @@
+'''
+
+Choose the audio format for the input and output devices.
+
+Opening each device with its own preferredFormat() can give the two sides
+different formats, and typically gives 44.1 kHz stereo, twice the data a
+voice feed needs. Instead we ask each device what it supports and plan
+one format that all the devices can use:
+
+  * 16-bit signed little-endian samples, which is what the relay and its
+    stages work in;
+  * a sample rate that is native to as many of the devices as possible,
+    where "native" means it is the rate of the device's preferred format,
+    so that neither the device nor the sound system has to resample; among
+    equally native rates, the lowest that is still good for voice;
+  * the fewest channels all the devices support, normally mono.
+
+Fewer bytes per millisecond let the same buffer duration be fewer bytes.
+The buffer is sized to a fixed duration rather than a fixed byte count.
+
+The user can pin a format for a device, stored in the settings under the
+device's name, choosing from the formats all the devices support (see
+common_formats()). A pinned format is used if all the devices support it.
+
+The plan carries a one-line reason, for showing in the status bar.
+
+When the devices have no 16-bit format in common, fallback_formats()
+opens the input in its preferred format, and the output at the same rate
+and channel count in its own preferred sample type, and the relay
+converts the samples (see convert.py). The relay does not resample or
+remix channels, so if the output cannot take the input's rate and
+channel count, the devices are not opened at all.
+
+'''
+from urllib.parse import quote
+
+from PyQt5.QtMultimedia import QAudioFormat
+
+from convert import SampleFormat
+
+# The only sample size the relay works in.
+SAMPLE_SIZE = 16
+
+# The lowest sample rate considered good enough for a voice feed.
+MIN_RATE = 16000
+
+# Duration of the input buffer. 384 bytes at 44.1 kHz stereo 16-bit, which
+# was found to be the smallest that did not sputter, is just under 2.2 ms.
+BUFFER_MS = 2.2
+
+# The settings group in which pinned formats are stored.
+PIN_GROUP = 'pinned_format'
+
+# What a device supports, taken from its QAudioDeviceInfo by device_caps().
+
+class DeviceCaps( object ) :
+    def __init__( self, name, rates, channels, sizes,
+                  preferred_rate, preferred_channels ) :
+        self.name = name
+        self.rates = set( rates )
+        self.channels = set( channels )
+        self.sizes = set( sizes )
+        self.preferred_rate = preferred_rate
+        self.preferred_channels = preferred_channels
+
+def device_caps( audio_info ) :
+    preferred = audio_info.preferredFormat()
+    # Sample sizes only count if they come as signed little-endian ints.
+    sizes = audio_info.supportedSampleSizes()
+    if QAudioFormat.SignedInt not in audio_info.supportedSampleTypes() \
+       or QAudioFormat.LittleEndian not in audio_info.supportedByteOrders() :
+        sizes = []
+    return DeviceCaps(
+        audio_info.deviceName(),
+        audio_info.supportedSampleRates(),
+        audio_info.supportedChannelCounts(),
+        sizes,
+        preferred.sampleRate(),
+        preferred.channelCount()
+    )
+
+# The result of planning: the format, the input buffer size to go with it,
+# and why it was chosen.
+
+class FormatPlan( object ) :
+    def __init__( self, rate, channels, reason ) :
+        self.rate = rate
+        self.channels = channels
+        self.size = SAMPLE_SIZE
+        self.reason = reason
+
+    def bytes_per_ms( self ) :
+        return self.rate * self.channels * ( self.size // 8 ) / 1000.0
+
+    # BUFFER_MS worth of bytes, rounded to a whole number of frames.
+    def buffer_bytes( self ) :
+        frame = self.channels * ( self.size // 8 )
+        frames = max( 1, round( BUFFER_MS * self.bytes_per_ms() / frame ) )
+        return frames * frame
+
+    def qt_format( self ) :
+        audio_format = QAudioFormat()
+        audio_format.setCodec( 'audio/pcm' )
+        audio_format.setSampleRate( self.rate )
+        audio_format.setChannelCount( self.channels )
+        audio_format.setSampleSize( self.size )
+        audio_format.setSampleType( QAudioFormat.SignedInt )
+        audio_format.setByteOrder( QAudioFormat.LittleEndian )
+        return audio_format
+
+    # The pinned-format string, as stored in the settings.
+    def pin( self ) :
+        return '{}/{}'.format( self.rate, self.channels )
+
+    def describe( self ) :
+        return '{} Hz {} {}-bit, {:.0f} bytes/ms, buffer {} bytes'.format(
+            self.rate,
+            'mono' if self.channels == 1 else '{} ch'.format( self.channels ),
+            self.size, self.bytes_per_ms(), self.buffer_bytes()
+        )
+
+# Plan a format for a list of DeviceCaps. Pins is a dict of device name to
+# pinned (rate, channels). Returns a FormatPlan, or None if the devices
+# have no 16-bit format in common.
+
+def plan_format( devices, pins=None ) :
+    rates = set.intersection( *[ device.rates for device in devices ] )
+    channels = set.intersection( *[ device.channels for device in devices ] )
+    sizes = set.intersection( *[ device.sizes for device in devices ] )
+    pins = pins or {}
+    if not rates or not channels or SAMPLE_SIZE not in sizes :
+        return None
+
+    # A pinned format wins if every device supports it.
+    notes = []
+    for device in devices :
+        if device.name in pins :
+            rate, count = pins[ device.name ]
+            if rate in rates and count in channels :
+                return FormatPlan( rate, count,
+                                   'pinned for {}'.format( device.name ) )
+            notes.append( 'pin for {} not usable'.format( device.name ) )
+
+    # Count for each rate the devices that prefer it, and keep the rates
+    # preferred by the most devices. Of those, take the lowest good for
+    # voice, or failing that the highest.
+    def native( rate ) :
+        return sum( 1 for device in devices if device.preferred_rate == rate )
+    most = max( native( rate ) for rate in rates )
+    candidates = [ rate for rate in rates if native( rate ) == most ]
+    voice = [ rate for rate in candidates if rate >= MIN_RATE ]
+    rate = min( voice ) if voice else max( candidates )
+    if most == len( devices ) :
+        notes.insert( 0, 'native rate of all devices' )
+    elif most > 0 :
+        notes.insert( 0, 'native rate of {} of {} devices'.format(
+            most, len( devices ) ) )
+    else :
+        notes.insert( 0, 'no native rate in common, devices resample' )
+    return FormatPlan( rate, min( channels ), '; '.join( notes ) )
+
+# The (rate, channels) pairs, lowest first, in which all of a list of
+# DeviceCaps support 16-bit samples: the formats the user may pin.
+
+def common_formats( devices ) :
+    rates = set.intersection( *[ device.rates for device in devices ] )
+    channels = set.intersection( *[ device.channels for device in devices ] )
+    sizes = set.intersection( *[ device.sizes for device in devices ] )
+    if SAMPLE_SIZE not in sizes :
+        return []
+    return sorted( ( rate, count ) for rate in rates for count in channels )
+
+# Read and write pinned formats in a QSettings. Device names can hold any
+# character, including the "/" that separates settings groups, so they
+# are quoted to make the keys.
+
+def load_pins( settings, names ) :
+    pins = {}
+    for name in names :
+        value = settings.value( PIN_GROUP + '/' + quote( name, safe='' ) )
+        if value :
+            try :
+                rate, count = [ int( part ) for part in str( value ).split( '/' ) ]
+            except ValueError :
+                continue # not written by us, ignore it
+            pins[ name ] = ( rate, count )
+    return pins
+
+def save_pin( settings, name, plan ) :
+    settings.setValue( PIN_GROUP + '/' + quote( name, safe='' ), plan.pin() )
+
+def clear_pins( settings ) :
+    settings.remove( PIN_GROUP )
+
+# The SampleFormat of a QAudioFormat, or None if its sample type is
+# unknown or its size is not one convert.py handles.
+
+SAMPLE_KINDS = {
+    QAudioFormat.SignedInt : 'int',
+    QAudioFormat.UnSignedInt : 'uint',
+    QAudioFormat.Float : 'float'
+}
+
+def sample_format( audio_format ) :
+    kind = SAMPLE_KINDS.get( audio_format.sampleType() )
+    bits = audio_format.sampleSize()
+    if kind is None or bits not in ( 8, 16, 24, 32 ) \
+       or ( kind == 'float' and bits != 32 ) :
+        return None
+    return SampleFormat(
+        bits, kind, audio_format.byteOrder() == QAudioFormat.LittleEndian )
+
+# The formats to open the main input and output in when plan_format()
+# finds none. Returns ( input format, output format, reason ), the
+# formats None if the relay cannot convert between the devices.
+
+def fallback_formats( input_info, otput_info ) :
+    in_format = input_info.preferredFormat()
+    ot_format = QAudioFormat( otput_info.preferredFormat() )
+    ot_format.setSampleRate( in_format.sampleRate() )
+    ot_format.setChannelCount( in_format.channelCount() )
+    in_sample = sample_format( in_format )
+    ot_sample = sample_format( ot_format )
+    if in_sample is None or ot_sample is None :
+        return None, None, 'no sample format the relay can convert'
+    if not otput_info.isFormatSupported( ot_format ) :
+        return None, None, 'output cannot play {} Hz {} ch'.format(
+            in_format.sampleRate(), in_format.channelCount() )
+    return in_format, ot_format, 'converting {}-bit {} to {}-bit {}'.format(
+        in_sample.bits, in_sample.kind, ot_sample.bits, ot_sample.kind )
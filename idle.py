@@ -0,0 +1,160 @@
+'''
+
+Power saving: suspend the audio devices when there is nothing to hear.
+
+If the sidetone has been muted for some seconds, both devices are
+suspended, and they are resumed the moment it is unmuted. If the input
+has been silent (its level below a threshold) for some seconds, only the
+output device is suspended; the input keeps running so that its level
+can still be watched, and the output is resumed by the first block that
+is loud enough, so resuming takes no longer than one block plus the time
+the device needs to restart.
+
+The IdleSuspender makes the decisions but knows nothing of Qt. Its
+stage() is a relay stage that measures the level of each block; its
+tick() is called every so often from a timer; and it calls back to the
+owner to actually suspend and resume the devices.
+
+It also measures itself: the CPU time used and the wall time spent while
+suspended, and the time from deciding to resume until the owner reports
+that audio is flowing again.
+
+'''
+import time
+
+import numpy
+
+# The states of an IdleSuspender: streaming normally, output suspended
+# for silence, both devices suspended for mute.
+ACTIVE = 'active'
+SILENT = 'silence'
+MUTED = 'mute'
+
+# Defaults for the period of mute or silence before suspending, in
+# seconds (0 means never), and the level below which input is silent,
+# in dB relative to full scale.
+IDLE_SECS = 10
+THRESHOLD_DB = -50
+
+class IdleSuspender( object ) :
+    def __init__( self, suspend, resume, idle_secs=IDLE_SECS,
+                  threshold_db=THRESHOLD_DB ) :
+        # Callbacks: suspend( state ) with SILENT or MUTED, and resume()
+        self.suspend_devices = suspend
+        self.resume_devices = resume
+        self.idle_secs = idle_secs
+        self.set_threshold( threshold_db )
+        self.state = ACTIVE
+        # When the input was last loud, and when mute was turned on (or
+        # None if not muted), by time.perf_counter().
+        self.loud_at = time.perf_counter()
+        self.muted_since = None
+        # Scratch arrays for measuring the level, made once and again only
+        # if the block size changes, so no NumPy object is made per block:
+        # the samples as floats, the scale that makes their sum of squares
+        # the mean square of samples at +/-1.0, that mean square, and
+        # whether it is over the threshold.
+        self.scratch = numpy.zeros( 0, dtype=numpy.float32 )
+        self.sample_scale = numpy.zeros( (), dtype=numpy.float32 )
+        self.power = numpy.zeros( (), dtype=numpy.float32 )
+        self.loud = numpy.zeros( (), dtype=bool )
+        # Measurements. While suspended, the wall and CPU clocks when
+        # suspension began. After a resume, when it was asked for, until
+        # resumed() is called.
+        self.suspended_wall = None
+        self.suspended_cpu = None
+        self.resume_asked = None
+        # Results of the last complete suspension: seconds suspended,
+        # percent of one CPU used meanwhile, and resume latency in ms.
+        self.last_idle_secs = None
+        self.last_idle_cpu = None
+        self.last_resume_ms = None
+
+    # Set the silence threshold in dBFS. The level is compared as mean
+    # square of samples scaled to +/-1.0, so convert once here.
+    def set_threshold( self, threshold_db ) :
+        self.threshold_db = threshold_db
+        self.threshold_power = numpy.array(
+            10.0 ** ( threshold_db / 10.0 ), dtype=numpy.float32 )
+
+    # Forget any suspension, for instance after the devices were replaced.
+    def reset( self ) :
+        self.state = ACTIVE
+        self.loud_at = time.perf_counter()
+        self.suspended_wall = None
+        self.resume_asked = None
+
+    # Called on any change of the mute switch.
+    def set_muted( self, muted ) :
+        if muted :
+            if self.muted_since is None :
+                self.muted_since = time.perf_counter()
+        else :
+            self.muted_since = None
+            # Treat unmuting as activity, so silence suspension waits
+            # its full period from now.
+            self.loud_at = time.perf_counter()
+            if self.state != ACTIVE :
+                self.resume()
+
+    # Relay stage: measure the level of the block. If it is loud, note the
+    # time, and if the output is suspended for silence, resume it now.
+
+    def stage( self, block ) :
+        samples = block.samples
+        if self.scratch.shape[0] != samples.shape[0] :
+            self.scratch = numpy.zeros( samples.shape[0], dtype=numpy.float32 )
+            self.sample_scale[()] = 1.0 / ( 32768 * samples.shape[0] ** 0.5 )
+        scratch = self.scratch
+        numpy.copyto( scratch, samples )
+        numpy.multiply( scratch, self.sample_scale, out=scratch )
+        numpy.dot( scratch, scratch, out=self.power )
+        numpy.greater( self.power, self.threshold_power, out=self.loud )
+        if self.loud :
+            self.loud_at = time.perf_counter()
+            if self.state == SILENT and self.muted_since is None :
+                self.resume()
+        return block
+
+    # Called periodically by a timer. Suspend if muted or silent long
+    # enough. Being muted while suspended for silence moves on to
+    # suspending for mute.
+
+    def tick( self ) :
+        if self.idle_secs <= 0 or self.state == MUTED :
+            return
+        now = time.perf_counter()
+        if self.muted_since is not None \
+           and now - self.muted_since >= self.idle_secs :
+            self.suspend( MUTED )
+        elif self.state == ACTIVE and now - self.loud_at >= self.idle_secs :
+            self.suspend( SILENT )
+
+    def suspend( self, state ) :
+        if self.state == ACTIVE :
+            self.suspended_wall = time.perf_counter()
+            self.suspended_cpu = time.process_time()
+        self.state = state
+        self.suspend_devices( state )
+
+    def resume( self ) :
+        self.resume_asked = time.perf_counter()
+        if self.suspended_wall is not None :
+            wall = self.resume_asked - self.suspended_wall
+            cpu = time.process_time() - self.suspended_cpu
+            self.last_idle_secs = wall
+            self.last_idle_cpu = 100.0 * cpu / wall if wall > 0 else 0.0
+            self.suspended_wall = None
+        self.state = ACTIVE
+        self.resume_devices()
+
+    # The owner calls this when the output is flowing again after a
+    # resume. Returns the resume latency in ms, or None if no resume was
+    # outstanding.
+
+    def resumed( self ) :
+        if self.resume_asked is None :
+            return None
+        self.last_resume_ms = 1000.0 * ( time.perf_counter() - self.resume_asked )
+        self.resume_asked = None
+        return self.last_resume_ms
@@ -0,0 +1,201 @@
+'''
+
+Mix several inputs into several outputs at once.
+
+A route sends one input to one output at some gain. With N inputs and M
+outputs the routes make an M-by-N matrix of gains, and each block of
+output is one matrix product of the gains with a block from each input:
+
+    out[ o ] = sum over i of gains[ o, i ] * in[ i ]
+
+which NumPy does in one call for all the routes.
+
+Each input has a Lane that assembles what is read from it into blocks,
+the same way the BlockRelay does. The first input is the clock: when it
+completes a block, the oldest waiting block of every other lane is mixed
+with it and the results written to the outputs. The devices do not run
+from one clock, so a lane may run ahead, or fall behind, of the first
+input. A lane that runs ahead keeps at most MAX_LAG_BLOCKS waiting and
+drops the oldest beyond that; a lane with nothing waiting counts as
+silence for that block. So no route lags by more than its own input's
+buffer and MAX_LAG_BLOCKS blocks. On the output side, each output device
+takes only what fits in its own buffer and the rest is dropped, so no
+route lags by more than its output's buffer either.
+
+As in the relay, all the arrays, and the views of their rows, are made
+once when the mixer is made, and the mixer is traced only when its
+tracer is not None. See bench.py for the allocations per block.
+
+'''
+import numpy
+
+from relay import Block, SAMPLE_DTYPE
+
+# Most complete blocks an input lane keeps waiting to be mixed.
+MAX_LAG_BLOCKS = 2
+
+# Blocks in a lane: those waiting, plus the one being filled.
+LANE_BLOCKS = MAX_LAG_BLOCKS + 2
+
+# One input: assemble what is read into blocks, and keep the complete
+# blocks in a ring until they are mixed.
+
+class Lane( object ) :
+    def __init__( self, source, block_bytes ) :
+        self.source = source
+        self.block_bytes = block_bytes
+        self.ring = [
+            Block( block_bytes, SAMPLE_DTYPE ) for i in range( LANE_BLOCKS )
+        ]
+        # Index in the ring of the oldest waiting block, the number of
+        # blocks waiting, and bytes filled so far in the next block.
+        self.oldest = 0
+        self.waiting = 0
+        self.filled = 0
+        # Count of blocks dropped because the lane ran ahead.
+        self.dropped = 0
+
+    # Copy bytes read from the source into the block being filled. Return
+    # True if that completed it.
+
+    def fill( self, data ) :
+        start = self.filled
+        self.filled = start + len( data )
+        block = self.ring[ ( self.oldest + self.waiting ) % LANE_BLOCKS ]
+        block.view[ start : self.filled ] = data
+        if self.filled < self.block_bytes :
+            return False
+        self.filled = 0
+        self.waiting += 1
+        if self.waiting > MAX_LAG_BLOCKS :
+            self.oldest = ( self.oldest + 1 ) % LANE_BLOCKS
+            self.waiting -= 1
+            self.dropped += 1
+        return True
+
+    # Return the oldest waiting block and forget it, or None if none.
+
+    def take( self ) :
+        if self.waiting == 0 :
+            return None
+        block = self.ring[ self.oldest ]
+        self.oldest = ( self.oldest + 1 ) % LANE_BLOCKS
+        self.waiting -= 1
+        return block
+
+class RouteMixer( object ) :
+    def __init__( self, sources, sinks, block_bytes ) :
+        itemsize = numpy.dtype( SAMPLE_DTYPE ).itemsize
+        self.block_bytes = block_bytes - ( block_bytes % itemsize )
+        samples = self.block_bytes // itemsize
+        self.lanes = [ Lane( source, self.block_bytes ) for source in sources ]
+        self.sinks = sinks
+        # The gains, outputs by inputs; all routes start silent.
+        self.gains = numpy.zeros( ( len( sinks ), len( sources ) ),
+                                  dtype=numpy.float32 )
+        # One block from each input, and the mix for each output, as
+        # floats; and the mix as samples to write.
+        self.mix_in = numpy.zeros( ( len( sources ), samples ),
+                                   dtype=numpy.float32 )
+        self.mix_out = numpy.zeros( ( len( sinks ), samples ),
+                                    dtype=numpy.float32 )
+        self.out_blocks = [
+            Block( self.block_bytes, SAMPLE_DTYPE ) for sink in sinks
+        ]
+        # Each lane with its row of mix_in, and each output with its block
+        # and its row of mix_out, paired once, because indexing the arrays
+        # makes a new view, and zip() new objects, every time.
+        self.inputs = list( zip( self.lanes, self.mix_in ) )
+        self.outputs = list( zip( sinks, self.out_blocks, self.mix_out ) )
+        # The limits of a sample, as NumPy arrays of the mix's type, so
+        # that NumPy neither makes an array of a Python number nor casts
+        # through a buffer of its own for every block.
+        self.low = numpy.array( -32768, dtype=numpy.float32 )
+        self.high = numpy.array( 32767, dtype=numpy.float32 )
+        # Count of blocks the outputs had no room for, in whole or part.
+        self.short_writes = 0
+        # BlockTracer when tracing, else None.
+        self.tracer = None
+
+    # Set the gains from an outputs-by-inputs array-like of floats.
+    def set_gains( self, gains ) :
+        numpy.copyto( self.gains, gains, casting='unsafe' )
+
+    # Slot for the readyRead signal of input number "index". Read until
+    # the input has no more; whenever the first input completes a block,
+    # mix and write a block to every output.
+
+    def relay( self, index ) :
+        if self.tracer is not None :
+            self.traced_relay( index, self.tracer )
+            return
+        lane = self.lanes[ index ]
+        source = lane.source
+        data = source.read( lane.block_bytes - lane.filled )
+        while data :
+            if lane.fill( data ) and index == 0 :
+                self.mix()
+            data = source.read( lane.block_bytes - lane.filled )
+
+    # Gather one block from every lane, silence for a lane with none
+    # waiting, mix them all with one matrix product, and write each mix.
+
+    def mix( self ) :
+        for lane, row in self.inputs :
+            block = lane.take()
+            if block is None :
+                row.fill( 0 )
+            else :
+                numpy.copyto( row, block.samples )
+        mix_out = self.mix_out
+        numpy.dot( self.gains, self.mix_in, out=mix_out )
+        numpy.maximum( mix_out, self.low, out=mix_out )
+        numpy.minimum( mix_out, self.high, out=mix_out )
+        for sink, block, row in self.outputs :
+            numpy.copyto( block.samples, row, casting='unsafe' )
+            if sink.write( block.data ) < self.block_bytes :
+                self.short_writes += 1
+
+    # The same as relay() and mix() but recording the time spent reading
+    # each input, mixing, and writing each output.
+
+    def traced_relay( self, index, tracer ) :
+        now = tracer.now
+        lane = self.lanes[ index ]
+        while True :
+            start = now()
+            data = lane.source.read( lane.block_bytes - lane.filled )
+            if not data :
+                tracer.complete( 'empty read', 'io', start, None,
+                                 ( 'input', ), index )
+                break
+            tracer.complete( 'read', 'io', start, None,
+                             ( 'input', 'bytes' ), index, len( data ) )
+            if lane.fill( data ) and index == 0 :
+                self.traced_mix( tracer )
+
+    def traced_mix( self, tracer ) :
+        now = tracer.now
+        block_start = now()
+        for lane, row in self.inputs :
+            block = lane.take()
+            if block is None :
+                row.fill( 0 )
+            else :
+                numpy.copyto( row, block.samples )
+        mix_out = self.mix_out
+        numpy.dot( self.gains, self.mix_in, out=mix_out )
+        numpy.maximum( mix_out, self.low, out=mix_out )
+        numpy.minimum( mix_out, self.high, out=mix_out )
+        tracer.complete( 'mix', 'process', block_start, None,
+                         ( 'inputs', 'outputs' ),
+                         len( self.lanes ), len( self.sinks ) )
+        for index, ( sink, block, row ) in enumerate( self.outputs ) :
+            start = now()
+            numpy.copyto( block.samples, row, casting='unsafe' )
+            written = sink.write( block.data )
+            if written < self.block_bytes :
+                self.short_writes += 1
+            tracer.complete( 'write', 'io', start, None,
+                             ( 'output', 'bytes' ), index, written )
+        tracer.complete( 'block', 'audio', block_start )
@@ -0,0 +1,190 @@
+'''
+
+Move audio from an input device to an output device one block at a time.
+
+The QAudioInput is started in "push" mode, so it hands back a QIODevice
+that emits readyRead when audio has arrived. The QAudioOutput is also
+started in push mode, so it hands back a QIODevice we write into. The
+relay() method is connected to readyRead; it reads the audio into blocks
+of fixed size, passes each full block through a list of processing
+stages, and writes it to the output.
+
+Having the audio pass through Python costs a little, but it gives us a
+place to process and to measure the audio, which the direct connection
+of input to output did not.
+
+At small buffer sizes there are hundreds of blocks a second, so the
+relay takes care not to create Python objects per block. The blocks come
+from a small pool made once when the relay is made, each a bytearray
+with a memoryview and a NumPy array viewing the same memory. Data read
+from Qt is copied into the current block in place. PyQt5 offers no way
+to read into an existing buffer, so the one bytes object per read that
+QIODevice.read() returns is the only allocation left in the audio path;
+it holds no references, so it is freed at once and never wakes the
+garbage collector. See bench.py for the allocation benchmark.
+
+A stage is a callable that takes a Block, changes its contents in place
+if it wants to, and returns it. A stage that changes the size of the
+samples, as a SampleConverter does (see convert.py), returns instead a
+Block of its own, made once, holding the result.
+
+'''
+import gc
+
+import numpy
+
+# Number of blocks in the pool. A stage may keep a reference to the
+# previous block or two (for look-back) without it being overwritten.
+POOL_BLOCKS = 4
+
+# Samples are 16-bit signed integers in machine byte order unless the
+# relay is told otherwise.
+SAMPLE_DTYPE = numpy.int16
+
+# One block of audio: the bytes, a memoryview of them, and an array of
+# samples viewing the same memory. None of these is ever reallocated.
+
+class Block( object ) :
+    __slots__ = ( 'data', 'view', 'samples' )
+    def __init__( self, block_bytes, dtype ) :
+        self.data = bytearray( block_bytes )
+        self.view = memoryview( self.data )
+        self.samples = numpy.frombuffer( self.data, dtype=dtype )
+
+class BlockRelay( object ) :
+    def __init__( self, source, sink, block_bytes, dtype=SAMPLE_DTYPE ) :
+        # QIODevice from QAudioInput.start(), which we read
+        self.source = source
+        # QIODevice from QAudioOutput.start(), which we write; and the
+        # sink currently written, which is a NullSink while held.
+        self.device_sink = sink
+        self.sink = sink
+        # Size of every block, a whole number of samples.
+        itemsize = numpy.dtype( dtype ).itemsize
+        self.block_bytes = block_bytes - ( block_bytes % itemsize )
+        # The pool of blocks, the index of the block being filled, and
+        # how many bytes of it are filled so far.
+        self.pool = [
+            Block( self.block_bytes, dtype ) for i in range( POOL_BLOCKS )
+        ]
+        self.pool_index = 0
+        self.block = self.pool[0]
+        self.filled = 0
+        # List of (name, callable) processing stages, applied in order.
+        self.stages = []
+        # Count of blocks the output had no room for, in whole or part.
+        self.short_writes = 0
+        # BlockTracer when tracing, else None.
+        self.tracer = None
+
+    def add_stage( self, name, stage ) :
+        self.stages.append( ( name, stage ) )
+
+    # Stop writing to the output, while it is suspended, so that stale
+    # audio does not pile up in it; and start again. Blocks are still read
+    # and passed through the stages meanwhile.
+
+    def hold( self ) :
+        self.sink = NULL_SINK
+
+    def release( self ) :
+        self.sink = self.device_sink
+
+    # Copy bytes read from the source into the block being filled. Return
+    # the block if that filled it, moving on to the next block of the
+    # pool, else None.
+
+    def fill( self, data ) :
+        start = self.filled
+        self.filled = start + len( data )
+        self.block.view[ start : self.filled ] = data
+        if self.filled < self.block_bytes :
+            return None
+        block = self.block
+        self.pool_index = ( self.pool_index + 1 ) % POOL_BLOCKS
+        self.block = self.pool[ self.pool_index ]
+        self.filled = 0
+        return block
+
+    # Slot connected to the readyRead signal of the source. Read until the
+    # source has no more, passing on each block as it fills. Each read asks
+    # for no more than fits in the current block. When tracing is off, the
+    # only cost added by tracing is the test of self.tracer.
+
+    def relay( self ) :
+        if self.tracer is not None :
+            self.traced_relay( self.tracer )
+            return
+        data = self.source.read( self.block_bytes - self.filled )
+        while data :
+            block = self.fill( data )
+            if block is not None :
+                for name, stage in self.stages :
+                    block = stage( block )
+                if self.sink.write( block.data ) < len( block.data ) :
+                    self.short_writes += 1
+            data = self.source.read( self.block_bytes - self.filled )
+
+    # The same as relay() but recording the time spent in each step of
+    # each block: the read from Qt, each stage, and the write to Qt.
+
+    def traced_relay( self, tracer ) :
+        now = tracer.now
+        while True :
+            block_start = now()
+            data = self.source.read( self.block_bytes - self.filled )
+            read_end = now()
+            if not data :
+                tracer.complete( 'empty read', 'io', block_start, read_end )
+                break
+            tracer.complete(
+                'read', 'io', block_start, read_end, ( 'bytes', ), len( data )
+            )
+            block = self.fill( data )
+            if block is None :
+                continue
+            for name, stage in self.stages :
+                start = now()
+                block = stage( block )
+                tracer.complete( name, 'process', start )
+            start = now()
+            written = self.sink.write( block.data )
+            if written < len( block.data ) :
+                self.short_writes += 1
+            end = now()
+            tracer.complete( 'write', 'io', start, end, ( 'bytes', ), written )
+            tracer.complete( 'block', 'audio', block_start, end )
+
+# A sink that throws away what is written to it.
+
+class NullSink( object ) :
+    def write( self, data ) :
+        return len( data )
+
+NULL_SINK = NullSink()
+
+# While audio is streaming, keep the cyclic garbage collector from
+# pausing the audio path. Everything alive when streaming starts is
+# frozen into the permanent generation so collections need not scan it,
+# and the threshold for a young collection is raised so they are rare.
+# The GUI still makes a little garbage, so the collector is not turned
+# off outright. Calls to quiet() and restore() may be repeated.
+
+STREAMING_GC_THRESHOLD = ( 100000, 50, 100 )
+
+class QuietGC( object ) :
+    def __init__( self ) :
+        self.saved_threshold = None
+
+    def quiet( self ) :
+        if self.saved_threshold is None :
+            self.saved_threshold = gc.get_threshold()
+            gc.collect()
+            gc.freeze()
+            gc.set_threshold( *STREAMING_GC_THRESHOLD )
+
+    def restore( self ) :
+        if self.saved_threshold is not None :
+            gc.set_threshold( *self.saved_threshold )
+            self.saved_threshold = None
+            gc.unfreeze()
@@ -12,9 +12,34 @@ an output are selected, corresponding audio devices are created
 and connected. The user can control the volume with a slider and
 mute with a checkbox.
 
+The audio passes through Python one block at a time (see relay.py), so
+that it can be processed and measured. For diagnosing crackles, the path
+can be traced (see tracing.py) by the Debug menu or the --trace option.
+
+To save power, the devices are suspended after a period of mute or of
+silence on the input (see idle.py).
+
+Optionally, the sidetone is ducked in the gaps between words, so that
+the user hears their voice but not the hiss of the mic (see vad.py).
+
+Besides the main route from the chosen input to the chosen output, the
+user can add extra routes from any input to any output, each with its own
+gain. When there are extra routes, all the devices they use are opened
+and a RouteMixer (see mixer.py) takes the place of the relay. Power
+saving and ducking apply only to the main route on its own.
+
+When the devices have no 16-bit format in common, the relay converts
+samples between them if the output can take the input's rate and
+channel count (see formats.py and convert.py). Extra routes then cannot
+be mixed, and only the main route is heard.
+
 '''
+import functools
+import json
+import os
+
 from PyQt5.QtCore import (
-    Qt,QTime
+    Qt,QTime,QTimer
 )
 
 from PyQt5.QtTest import QTest
@@ -22,13 +47,16 @@ from PyQt5.QtTest import QTest
 from PyQt5.QtGui import QPixmap
 
 from PyQt5.QtWidgets import (
+    QAction,
     QApplication,
     QCheckBox,
     QComboBox,
     QHBoxLayout,
     QLabel,
     QMainWindow,
+    QPushButton,
     QSlider,
+    QSpinBox,
     QVBoxLayout,
     QWidget
 )
@@ -39,6 +67,68 @@ from PyQt5.QtMultimedia import (
     QAudioOutput
 )
 
+from convert import INT16, SampleConverter, block_dtype, sample_bytes
+from formats import (
+    FormatPlan, clear_pins, common_formats, device_caps, fallback_formats,
+    load_pins, plan_format, sample_format, save_pin
+)
+from idle import IdleSuspender, IDLE_SECS, THRESHOLD_DB, MUTED
+from mixer import RouteMixer
+from relay import BlockRelay, QuietGC
+from tracing import BlockTracer, traced_slot
+from vad import VoiceDucker, THRESHOLD_DB as DUCK_DB, HANGOVER_MS
+
+# The choice of buffer size has a major impact on the lag. It needs
+# to be small or there is severe echo; but if it is too small, there
+# is a sputtering or "motor-boating" effect. Normally the size is planned
+# along with the format (see formats.py); this is for when it can't be.
+BUFFER_BYTES = 384
+
+# How often, in ms, to check whether to suspend the devices to save power.
+IDLE_CHECK_MS = 500
+
+# When mixing, the buffer of each output device holds this many blocks,
+# which bounds how far any route to it can lag.
+MIX_OUTPUT_BLOCKS = 4
+
+'''
+
+One of the following is made for each extra route. It is a row of
+widgets: combo boxes to choose the input and the output, in the same
+order as those of the main route, a gain slider, and a button to remove
+the route. The SideToneWidget connects its signals.
+
+'''
+class RouteRow( QWidget ) :
+    def __init__( self, in_dev_names, ot_dev_names, in_dev_name, ot_dev_name,
+                  gain ) :
+        super().__init__()
+        self.cb_input = QComboBox()
+        self.cb_input.addItems( in_dev_names )
+        if in_dev_name in in_dev_names :
+            self.cb_input.setCurrentIndex( in_dev_names.index( in_dev_name ) )
+        self.cb_otput = QComboBox()
+        self.cb_otput.addItems( ot_dev_names )
+        if ot_dev_name in ot_dev_names :
+            self.cb_otput.setCurrentIndex( ot_dev_names.index( ot_dev_name ) )
+        self.gain = QSlider( Qt.Horizontal )
+        self.gain.setMinimum( 0 )
+        self.gain.setMaximum( 100 )
+        self.gain.setValue( gain )
+        self.remove = QPushButton( 'Remove' )
+        hb_route = QHBoxLayout()
+        hb_route.setContentsMargins( 0, 0, 0, 0 )
+        hb_route.addWidget( self.cb_input, 1 )
+        hb_route.addWidget( self.cb_otput, 1 )
+        hb_route.addWidget( self.gain, 1 )
+        hb_route.addWidget( self.remove, 0 )
+        self.setLayout( hb_route )
+
+    # The route as (input name, output name, gain 0-100) for the settings.
+    def route( self ) :
+        return [ self.cb_input.currentText(), self.cb_otput.currentText(),
+                 self.gain.value() ]
+
 '''
 
 One instance of the following class is instantiated and made the "central
@@ -62,6 +152,46 @@ class SideToneWidget( QWidget ) :
         self.input_device = None
         # Slot that will point to a QAudioOutput in time
         self.otput_device = None
+        # The QAudioDeviceInfo of each, once chosen
+        self.input_info = None
+        self.otput_info = None
+        # QAudioInputs and QAudioOutputs used only by extra routes, and the
+        # names of all the devices in the order the RouteMixer numbers them
+        self.extra_inputs = []
+        self.extra_otputs = []
+        self.mix_input_names = []
+        self.mix_otput_names = []
+        # The FormatPlan for all the devices, the input buffer size in bytes,
+        # and the (rate, channels) pairs all the devices support for pinning
+        self.plan = None
+        self.format_choices = []
+        self.buffer_bytes = BUFFER_BYTES
+        # Slot that will point to the BlockRelay between the two
+        self.relay = None
+        # Slot that will point to the RouteMixer when there are extra routes
+        self.mixer = None
+        # Keeps the garbage collector quiet while audio is streaming
+        self.quiet_gc = QuietGC()
+        # Count of audio glitches: output underruns, and blocks the output
+        # had no room for in relays and mixers since replaced
+        self.glitches = 0
+        # BlockTracer while tracing, else None; and where to save it
+        self.tracer = None
+        self.trace_path = os.path.join(
+            os.path.expanduser( '~' ), 'sidetone-trace.json' )
+        # Decides when to suspend the devices, with the settings of the
+        # last run. It calls idle_suspend and idle_resume to do the work.
+        self.idle = IdleSuspender(
+            self.idle_suspend, self.idle_resume,
+            idle_secs=int( self.settings.value( 'idle_secs', IDLE_SECS ) ),
+            threshold_db=int( self.settings.value( 'idle_db', THRESHOLD_DB ) )
+        )
+        # Ducks the gaps between words, with the settings of the last run.
+        self.ducker = VoiceDucker(
+            threshold_db=int( self.settings.value( 'duck_db', DUCK_DB ) ),
+            hangover_ms=int( self.settings.value( 'duck_ms', HANGOVER_MS ) )
+        )
+        self.ducker.enabled = bool( int( self.settings.value( 'duck_on', 0 ) ) )
         # set up layout, creating:
         #   self.input_info_list, list of QAudioInfo for inputs
         #   self.cb_inputs, combox of input names in same order
@@ -69,6 +199,14 @@ class SideToneWidget( QWidget ) :
         #   self.cb_otputs, combox of output names in same order
         #   self.volume, volume slider
         #   self.mute, mute checkbox
+        #   self.idle_secs, power-save delay spinbox
+        #   self.idle_db, power-save silence threshold spinbox
+        #   self.duck, ducking checkbox
+        #   self.duck_db, ducking voice threshold spinbox
+        #   self.duck_ms, ducking hangover spinbox
+        #   self.route_rows, list of RouteRow for the extra routes
+        #   self.routes_layout, layout the RouteRows are in
+        #   self.add_route, button to add a route
         self._uic()
         # Connect up signals to slots. Up to this point, the changes that
         # _uic() made in e.g. the volume or mute, or the combobox selections,
@@ -81,6 +219,22 @@ class SideToneWidget( QWidget ) :
         # Changes in the combox selections go to in_device and ot_device
         self.cb_inputs.currentIndexChanged.connect( self.in_dev_change )
         self.cb_otputs.currentIndexChanged.connect( self.ot_dev_change )
+        # Changes to the power-save settings go to the IdleSuspender
+        self.idle_secs.valueChanged.connect( self.idle_secs_change )
+        self.idle_db.valueChanged.connect( self.idle_db_change )
+        # Changes to the ducking settings go to the VoiceDucker
+        self.duck.stateChanged.connect( self.duck_change )
+        self.duck_db.valueChanged.connect( self.duck_db_change )
+        self.duck_ms.valueChanged.connect( self.duck_ms_change )
+        # Changes to the routes go to the route slots
+        self.add_route.clicked.connect( self.add_route_click )
+        for row in self.route_rows :
+            self.connect_route_row( row )
+        # Tell it the mute state we start with, and start checking.
+        self.idle.set_muted( self.mute.isChecked() )
+        self.idle_timer = QTimer( self )
+        self.idle_timer.timeout.connect( self.idle_tick )
+        self.idle_timer.start( IDLE_CHECK_MS )
         # Now pretend the user has made a selection of the in and out devices.
         # That should result in activating everythings.
         self.in_dev_change( self.cb_inputs.currentIndex() )
@@ -94,6 +248,15 @@ class SideToneWidget( QWidget ) :
 
     def disconnect_devices( self ) :
 
+        # Stop the relay or mixer reading, and count its glitches.
+        if self.relay is not None :
+            disconnect_signal( self.relay.source.readyRead )
+            self.glitches += self.relay.short_writes
+        if self.mixer is not None :
+            for lane in self.mixer.lanes :
+                disconnect_signal( lane.source.readyRead )
+            self.glitches += self.mixer.short_writes
+
         # If an output device exists, make it stop. That prevents it
         # trying to pull any data from the input device if any.
         if self.otput_device is not None :
@@ -102,6 +265,14 @@ class SideToneWidget( QWidget ) :
         # loses track of the output device it was formerly connected to.
         if self.input_device is not None :
             self.input_device.stop()
+        # Likewise any devices of extra routes.
+        for device in self.extra_otputs + self.extra_inputs :
+            device.stop()
+        # Stopping the devices closed their QIODevices; drop the relay or
+        # mixer, and let the garbage collector run normally again.
+        self.relay = None
+        self.mixer = None
+        self.quiet_gc.restore()
 
     # Method to connect the input and output devices, if both exist. This is
     # called after making any change in device selection.
@@ -111,20 +282,94 @@ class SideToneWidget( QWidget ) :
         if (self.input_device is not None) \
            and (self.otput_device is not None ) :
 
-            # Connect the devices by asking the OUTput device for its
-            # QIODevice, and passing that to the INput device's start()
-            # method. This could equally well be done the other way,
-            # by passing the input dev's IODevice to the output device.
-
-            self.input_device.start( self.otput_device.start() )
-            #self.otput_device.start( self.input_device.start() )
+            # With extra routes, the mixer does the work, if the devices
+            # share the 16-bit format it works in.
+            if self.route_rows :
+                if self.plan is not None :
+                    self.start_mixer()
+                    return
+                self.show_status(
+                    'No common 16-bit format, extra routes not mixed', 5000 )
+
+            # Start both devices in push mode, getting a QIODevice to
+            # write to from the OUTput device, and one to read from, that
+            # signals readyRead when there is data, from the INput device.
+            # Start the output first so it is ready when data comes.
+
+            sink = self.otput_device.start()
+            source = self.input_device.start()
+
+            # The stages work in INT16 samples. If the input is in some
+            # other format, blocks are whole frames of it, and the first
+            # stage converts them; if the output is, the last stage does.
+            audio_format = self.input_device.format()
+            in_sample = sample_format( audio_format ) or INT16
+            ot_sample = sample_format( self.otput_device.format() ) or INT16
+            frame_bytes = sample_bytes( in_sample ) * audio_format.channelCount()
+            block_bytes = self.buffer_bytes - self.buffer_bytes % frame_bytes
+            samples = block_bytes // sample_bytes( in_sample )
+            self.relay = BlockRelay(
+                source, sink, block_bytes, block_dtype( in_sample ) )
+            self.relay.tracer = self.tracer
+            source.readyRead.connect( self.relay.relay )
+            if in_sample != INT16 :
+                self.relay.add_stage( 'convert in', SampleConverter(
+                    in_sample, INT16, samples ).stage )
+
+            # Measure the input level for power saving. The new devices
+            # are not suspended, so neither is the IdleSuspender.
+            self.relay.add_stage( 'level', self.idle.stage )
+            self.idle.reset()
+
+            # Duck the gaps between words, if wanted, in this format.
+            self.ducker.configure(
+                audio_format.sampleRate(), audio_format.channelCount() )
+            self.relay.add_stage( 'duck', self.ducker.stage )
+
+            if ot_sample != INT16 :
+                self.relay.add_stage( 'convert out', SampleConverter(
+                    INT16, ot_sample, samples ).stage )
+
+            # Keep the garbage collector from pausing the stream.
+            self.quiet_gc.quiet()
 
             # In case the output device was just created, set its volume.
             self.set_volume()
 
+    # Method to start all the devices and connect them through a RouteMixer.
+    # The main input is the mixer's input 0, whose blocks set the pace, and
+    # the main output is its output 0.
+
+    def start_mixer( self ) :
+
+        otputs = [ self.otput_device ] + self.extra_otputs
+        inputs = [ self.input_device ] + self.extra_inputs
+        for device in otputs :
+            device.setBufferSize( MIX_OUTPUT_BLOCKS * self.buffer_bytes )
+        sinks = [ device.start() for device in otputs ]
+        sources = [ device.start() for device in inputs ]
+        self.mixer = RouteMixer( sources, sinks, self.buffer_bytes )
+        self.mixer.tracer = self.tracer
+        for index, source in enumerate( sources ) :
+            source.readyRead.connect(
+                functools.partial( self.mixer.relay, index ) )
+
+        # Nothing measures the input level for power saving, so it is off
+        # while mixing; forget any suspension of the devices replaced.
+        self.idle.reset()
+
+        # Keep the garbage collector from pausing the stream.
+        self.quiet_gc.quiet()
+
+        # Set the gains of the routes.
+        self.set_volume()
+
     # Method to set the volume on the output device. (The input device volume
     # is always 1.0.) This is called on any change of the volume slider or
-    # of the Mute button or of the output device choice.
+    # of the Mute button or of the output device choice. When mixing, the
+    # volume is the gain of the main route, and the output devices are
+    # wide open. When ducking, the volume is the gain the VoiceDucker
+    # ramps up to during speech, and the output device is wide open.
 
     def set_volume( self ) :
         if self.mute.isChecked() :
@@ -133,11 +378,19 @@ class SideToneWidget( QWidget ) :
         else :
             # Mute is OFF, set volume to float version of volume slider
             volume = self.volume.value() / 100
-        if self.otput_device :
+        if self.mixer is not None :
+            for device in [ self.otput_device ] + self.extra_otputs :
+                device.setVolume( 1.0 )
+            self.mixer.set_gains( self.route_gains( volume ) )
+        elif self.otput_device and self.ducker.enabled :
+            self.ducker.level = volume
+            self.otput_device.setVolume( 1.0 )
+        elif self.otput_device :
             # an output device exists (almost always true), set it
             self.otput_device.setVolume( volume )
 
     # Slot entered upon any change in the volume slider widget.
+    @traced_slot
     def volume_change( self, new_level ) :
         if self.mute.isChecked() :
             # The Mute button is ON; assume the user wants it OFF, else why
@@ -147,10 +400,119 @@ class SideToneWidget( QWidget ) :
             # The Mute button is OFF, just change the volume.
             self.set_volume()
 
+    # Make the mixer's gains, outputs by inputs: the main route at the given
+    # volume, plus each extra route at its own gain unless muted. Two routes
+    # between the same devices add together.
+
+    def route_gains( self, volume ) :
+        gains = [ [ 0.0 ] * len( self.mix_input_names )
+                  for name in self.mix_otput_names ]
+        gains[0][0] = volume
+        if not self.mute.isChecked() :
+            for row in self.route_rows :
+                in_dev_name, ot_dev_name, gain = row.route()
+                gains[ self.mix_otput_names.index( ot_dev_name ) ] \
+                     [ self.mix_input_names.index( in_dev_name ) ] += gain / 100
+        return gains
+
+    # Slots for the extra routes. Adding, removing or changing the devices
+    # of a route reopens all the devices; changing its gain just sets the
+    # mixer's gains.
+
+    def connect_route_row( self, row ) :
+        row.cb_input.currentIndexChanged.connect( self.routes_change )
+        row.cb_otput.currentIndexChanged.connect( self.routes_change )
+        row.gain.valueChanged.connect( self.route_gain_change )
+        row.remove.clicked.connect(
+            functools.partial( self.remove_route_click, row ) )
+
+    @traced_slot
+    def add_route_click( self, *args ) :
+        row = self.new_route_row(
+            self.cb_inputs.currentText(), self.cb_otputs.currentText(), 50 )
+        self.connect_route_row( row )
+        self.routes_change()
+
+    @traced_slot
+    def remove_route_click( self, row, *args ) :
+        self.route_rows.remove( row )
+        self.routes_layout.removeWidget( row )
+        row.deleteLater()
+        self.routes_change()
+
+    @traced_slot
+    def routes_change( self, *args ) :
+        self.disconnect_devices()
+        self.create_devices()
+        self.reconnect_devices()
+
+    @traced_slot
+    def route_gain_change( self, new_level ) :
+        self.set_volume()
+
     # Slot entered upon toggling of the mute switch, by the user or by the
     # code calling mute.setChecked(). Make sure the volume is set appropriately.
+    @traced_slot
     def mute_change( self, onoff ) :
         self.set_volume()
+        # Unmuting resumes the devices if they were suspended.
+        self.idle.set_muted( self.mute.isChecked() )
+
+    # Slots for changes of the ducking switch, voice threshold and hangover.
+    @traced_slot
+    def duck_change( self, onoff ) :
+        self.ducker.enabled = self.duck.isChecked()
+        self.set_volume()
+    @traced_slot
+    def duck_db_change( self, db ) :
+        self.ducker.set_threshold( db )
+    @traced_slot
+    def duck_ms_change( self, ms ) :
+        self.ducker.set_hangover( ms )
+
+    # Slots for changes of the power-save delay and silence threshold.
+    @traced_slot
+    def idle_secs_change( self, secs ) :
+        self.idle.idle_secs = secs
+    @traced_slot
+    def idle_db_change( self, db ) :
+        self.idle.set_threshold( db )
+
+    # Slot for the idle timer. Only the relay measures the input level,
+    # so there is nothing to decide while the mixer runs, or nothing does.
+
+    def idle_tick( self ) :
+        if self.relay is None :
+            return
+        self.idle.tick()
+
+    # Called by the IdleSuspender to save power. When suspending for mute,
+    # suspend both devices. When suspending for silence, suspend only the
+    # output, and hold the relay from writing to it, so the input level
+    # is still measured and the first loud block can resume the output.
+
+    def idle_suspend( self, state ) :
+        if self.relay is None :
+            return
+        self.relay.hold()
+        self.otput_device.suspend()
+        if state == MUTED :
+            self.input_device.suspend()
+        if self.tracer is not None :
+            self.tracer.instant( 'suspend', 'power', ( 'for', ), state )
+        self.show_status( 'Power save: suspended for ' + state, 3000 )
+
+    # Called by the IdleSuspender to resume the devices. Resuming a device
+    # that is not suspended does nothing.
+
+    def idle_resume( self ) :
+        if self.relay is None :
+            return
+        self.input_device.resume()
+        self.otput_device.resume()
+        self.relay.release()
+        if self.tracer is not None :
+            self.tracer.instant( 'resume', 'power' )
 
     # Slots for selection of the input and output devices. On startup we have
     # neither an input nor an output device. We do not know which combox the
@@ -159,92 +521,246 @@ class SideToneWidget( QWidget ) :
     # Slot entered upon any change in the selection of the input device
     # combo box. The argument is the new index of the list of values.
 
+    @traced_slot
     def in_dev_change( self, new_index ) :
 
         # Disconnect and stop the devices if they are connected.
         self.disconnect_devices()
 
-        self.input_device = None # device object goes out of scope
-
-        # Get the QAudioDeviceInfo corresponding to this index of the combox.
-        audio_info = self.input_info_list[ new_index ]
-
-        # Create a new QAudioInput based on that.
-        preferred_format = audio_info.preferredFormat()
-        self.input_device = QAudioInput( audio_info, preferred_format )
-
-        # the input device volume is always 1.0, wide open.
-        self.input_device.setVolume( 1.0 )
-
-        # The choice of buffer size has a major impact on the lag. It needs
-        # to be small or there is severe echo; but if it is too small, there
-        # is a sputtering or "motor-boating" effect.
-        self.input_device.setBufferSize( 384 )
-
-        # hook up possible debug status display
-        self.input_device.stateChanged.connect(self.in_dev_state_change)
-
-        # reconnect the devices if possible.
+        # Note the QAudioDeviceInfo corresponding to this index of the combox.
+        self.input_info = self.input_info_list[ new_index ]
 
+        # Create both devices in a format that suits the pair, and
+        # reconnect them if possible.
+        self.create_devices()
         self.reconnect_devices()
 
     # Slot entered upon any change in the selection of output. The argument
     # is the index to the list of output devices in the combobox.
 
+    @traced_slot
     def ot_dev_change( self, new_index ) :
-        print('index',new_index)
+
         # Disconnect and stop the devices if they are connected.
         self.disconnect_devices()
 
-        self.otput_device = None # device object goes out of scope
+        # Note the QAudioDeviceInfo corresponding to this index of the combox.
+        self.otput_info = self.otput_info_list[ new_index ]
 
-        # Get the QAudioDeviceInfo corresponding to this index of the combox.
-        audio_info = self.otput_info_list[ new_index ]
+        # Create both devices in a format that suits the pair, and
+        # reconnect them if possible. Which also sets the volume.
+        self.create_devices()
+        self.reconnect_devices()
+
+    # Method to create the QAudioInput and QAudioOutput, once both have been
+    # chosen, and those of any extra routes. All are created whenever any
+    # choice changes, because the format must suit all of them (see
+    # formats.py). The status bar says what format was chosen, and why.
+
+    def create_devices( self ) :
+
+        self.discard_devices()
+        if self.input_info is None or self.otput_info is None :
+            return
+
+        # List the devices of all routes, each once, main devices first.
+        in_infos = [ self.input_info ]
+        ot_infos = [ self.otput_info ]
+        for row in self.route_rows :
+            in_info = self.input_info_list[ row.cb_input.currentIndex() ]
+            ot_info = self.otput_info_list[ row.cb_otput.currentIndex() ]
+            if in_info.deviceName() not in \
+                    [ info.deviceName() for info in in_infos ] :
+                in_infos.append( in_info )
+            if ot_info.deviceName() not in \
+                    [ info.deviceName() for info in ot_infos ] :
+                ot_infos.append( ot_info )
+        self.mix_input_names = [ info.deviceName() for info in in_infos ]
+        self.mix_otput_names = [ info.deviceName() for info in ot_infos ]
+
+        # Plan a format for them all, honoring any format pinned for any.
+        names = self.mix_input_names + self.mix_otput_names
+        caps = [ device_caps( info ) for info in in_infos + ot_infos ]
+        self.plan = plan_format( caps, load_pins( self.settings, names ) )
+        self.format_choices = common_formats( caps )
+        if self.plan is not None :
+            in_format = ot_format = self.plan.qt_format()
+            self.buffer_bytes = self.plan.buffer_bytes()
+            self.show_status(
+                self.plan.describe() + ': ' + self.plan.reason, 5000 )
+        else :
+            # No 16-bit format in common; let the relay convert samples
+            # between the devices if it can, else leave them closed.
+            in_format, ot_format, reason = fallback_formats(
+                self.input_info, self.otput_info )
+            self.buffer_bytes = BUFFER_BYTES
+            self.show_status( 'No common 16-bit format, ' + reason, 5000 )
+            if in_format is None :
+                return
+
+        # Create a new QAudioInput in that format.
+        self.input_device = QAudioInput( self.input_info, in_format )
 
-        # Create a new QAudioOutput based on that.
-        preferred_format = audio_info.preferredFormat()
-        self.otput_device = QAudioOutput( audio_info, preferred_format )
+        # the input device volume is always 1.0, wide open.
+        self.input_device.setVolume( 1.0 )
+
+        # Keep the buffer small, see formats.BUFFER_MS.
+        self.input_device.setBufferSize( self.buffer_bytes )
+
+        # hook up possible debug status display
+        self.input_device.stateChanged.connect(self.in_dev_state_change)
+
+        # Create a new QAudioOutput in the same format.
+        self.otput_device = QAudioOutput( self.otput_info, ot_format )
         self.otput_device.setVolume( 0 ) # reconnect will set correct volume
 
         # hook up possible debug status display
         self.otput_device.stateChanged.connect(self.ot_dev_state_change)
 
-        # reconnect the devices if possible. Which also sets the volume.
-
+        # Create the devices of extra routes in the same way.
+        for info in in_infos[ 1 : ] :
+            device = QAudioInput( info, in_format )
+            device.setVolume( 1.0 )
+            device.setBufferSize( self.buffer_bytes )
+            device.stateChanged.connect( self.in_dev_state_change )
+            self.extra_inputs.append( device )
+        for info in ot_infos[ 1 : ] :
+            device = QAudioOutput( info, ot_format )
+            device.setVolume( 0 )
+            device.stateChanged.connect( self.ot_dev_state_change )
+            self.extra_otputs.append( device )
+
+    # Method to let go of all the devices, disconnecting their signals so
+    # that nothing refers to them and they are deleted at once, rather than
+    # whenever the garbage collector gets around to it.
+
+    def discard_devices( self ) :
+        for device in [ self.input_device ] + self.extra_inputs :
+            if device is not None :
+                disconnect_signal( device.stateChanged )
+        for device in [ self.otput_device ] + self.extra_otputs :
+            if device is not None :
+                disconnect_signal( device.stateChanged )
+        self.input_device = None # device objects go out of scope
+        self.otput_device = None
+        self.extra_inputs = []
+        self.extra_otputs = []
+
+    # The count of glitches so far, including those of the current relay
+    # or mixer.
+
+    def glitch_count( self ) :
+        count = self.glitches
+        if self.relay is not None :
+            count += self.relay.short_writes
+        if self.mixer is not None :
+            count += self.mixer.short_writes
+        return count
+
+    # Pin the current format, or one of self.format_choices, for all
+    # current devices, or forget all pinned formats and plan afresh. Called
+    # from the Format menu of the main window. A chosen format takes effect
+    # at once, by making the devices again.
+
+    def pin_format( self ) :
+        if self.plan is not None :
+            for name in self.mix_input_names + self.mix_otput_names :
+                save_pin( self.settings, name, self.plan )
+            self.show_status( 'Pinned ' + self.plan.describe(), 3000 )
+
+    def pin_chosen_format( self, rate, channels, *args ) :
+        plan = FormatPlan( rate, channels, 'chosen' )
+        for name in self.mix_input_names + self.mix_otput_names :
+            save_pin( self.settings, name, plan )
+        self.disconnect_devices()
+        self.create_devices()
         self.reconnect_devices()
 
+    def clear_pinned_formats( self ) :
+        clear_pins( self.settings )
+        self.disconnect_devices()
+        self.create_devices()
+        self.reconnect_devices()
 
     # Show some text in the main-window status bar for 1 second, more or less.
     def show_status( self, text, duration=1000 ):
         self.status_bar.showMessage( text, duration )
 
+    # Start or stop tracing the audio path. Called from the Debug menu
+    # of the main window, or at startup for the --trace option. When
+    # tracing stops, the trace is saved to self.trace_path.
+
+    def set_tracing( self, onoff ) :
+        if onoff :
+            if self.tracer is None :
+                self.tracer = BlockTracer()
+                self.tracer.start()
+                self.show_status( 'Tracing to ' + self.trace_path, 3000 )
+        elif self.tracer is not None :
+            tracer = self.tracer
+            self.tracer = None
+            tracer.stop()
+            count = tracer.save( self.trace_path )
+            self.show_status(
+                '{} trace events saved in {}'.format( count, self.trace_path ),
+                5000
+            )
+        if self.relay is not None :
+            self.relay.tracer = self.tracer
+        if self.mixer is not None :
+            self.mixer.tracer = self.tracer
+
     # Slots called on any "state" change of an audio device. Optionally
-    # show the state in the main window status bar.
+    # show the state in the main window status bar. When tracing, the
+    # state changes are recorded in the trace.
     def in_dev_state_change( self, new_state):
+        if self.tracer is not None :
+            self.tracer.instant(
+                'input state', 'device', ( 'state', ), int( new_state ) )
         #self.show_status(
             #'{} in dev state {}'.format(self.time.elapsed(),int(new_state))
         #)
-        pass
     def ot_dev_state_change( self, new_state):
+        if self.tracer is not None :
+            self.tracer.instant(
+                'output state', 'device', ( 'state', ), int( new_state ) )
+        # An output going idle for want of data is a glitch.
+        device = self.sender()
+        if new_state == QAudio.IdleState and device is not None \
+           and device.error() == QAudio.UnderrunError :
+            self.glitches += 1
+        # The output becoming active after a power-save resume completes
+        # the resume; report how long it took and how idle we were.
+        if new_state == QAudio.ActiveState :
+            resume_ms = self.idle.resumed()
+            if resume_ms is not None and self.idle.last_idle_secs is not None :
+                self.show_status(
+                    'Resumed in {:.1f} ms after {:.0f} s idle at {:.2f}% CPU'.format(
+                        resume_ms, self.idle.last_idle_secs,
+                        self.idle.last_idle_cpu ),
+                    5000 )
         #self.show_status(
             #'{} ot dev state {}'.format(self.time.elapsed(),int(new_state))
         #)
-        pass
 
     # Close events are only received by a top-level widget. When our top-level
     # widget gets one, indicating the app is done, it calls this method.
 
     def closeEvent( self, event ) :
+        # if tracing, stop and save the trace.
+        self.set_tracing( False )
+
         # if we have devices, make them stop.
         self.disconnect_devices()
 
         # if the devices exist, reset them and then trash them.
         if self.otput_device is not None:
             self.otput_device.reset()
-            self.otput_device = None
         if self.input_device is not None:
             self.input_device.reset()
-            self.input_device = None
+        for device in self.extra_otputs + self.extra_inputs :
+            device.reset()
+        self.discard_devices()
 
         # Save the current selection of the input and output combo boxes,
         # in the settings file.
@@ -257,6 +773,31 @@ class SideToneWidget( QWidget ) :
         self.settings.setValue( 'volume', self.volume.value() )
         self.settings.setValue( 'mute_status', int( self.mute.isChecked() ) )
 
+        # Save the power-save settings.
+        self.settings.setValue( 'idle_secs', self.idle_secs.value() )
+        self.settings.setValue( 'idle_db', self.idle_db.value() )
+
+        # Save the ducking settings.
+        self.settings.setValue( 'duck_on', int( self.duck.isChecked() ) )
+        self.settings.setValue( 'duck_db', self.duck_db.value() )
+        self.settings.setValue( 'duck_ms', self.duck_ms.value() )
+
+        # Save the extra routes.
+        self.settings.setValue( 'routes',
+            json.dumps( [ row.route() for row in self.route_rows ] ) )
+
+    # Make a RouteRow for an extra route and add it to the routes box.
+    # The caller connects its signals.
+
+    def new_route_row( self, in_dev_name, ot_dev_name, gain ) :
+        row = RouteRow(
+            [ info.deviceName() for info in self.input_info_list ],
+            [ info.deviceName() for info in self.otput_info_list ],
+            in_dev_name, ot_dev_name, gain )
+        self.route_rows.append( row )
+        self.routes_layout.addWidget( row )
+        return row
+
     def _uic( self ) :
         '''
     set up our layout which consists of:
@@ -264,6 +805,11 @@ class SideToneWidget( QWidget ) :
                  Big Honkin' Label
         [input combobox]    [output combobox]
                [volume slider]  [x] Mute
+      Power save after [secs] below [dB]
+    [x] Duck gaps, voice above [dB] hold [ms]
+        Extra routes                [Add route]
+        [input] [output] [gain slider] [Remove]
+        ...
 
     Hooking the signals to useful slots is the job
     of __init__. Here just make the layout.
@@ -346,15 +892,90 @@ class SideToneWidget( QWidget ) :
         hb_volume.addWidget( self.mute, 0)
         hb_volume.addStretch( 1 )
 
+        # Create spinboxes for the power-save delay, where 0 means never,
+        # and the level below which the input counts as silent.
+        self.idle_secs = QSpinBox()
+        self.idle_secs.setRange( 0, 3600 )
+        self.idle_secs.setSuffix( ' s' )
+        self.idle_secs.setSpecialValueText( 'never' )
+        self.idle_secs.setValue( self.idle.idle_secs )
+        self.idle_db = QSpinBox()
+        self.idle_db.setRange( -90, 0 )
+        self.idle_db.setSuffix( ' dB' )
+        self.idle_db.setValue( self.idle.threshold_db )
+
+        # Put those in a row with labels
+        hb_idle = QHBoxLayout()
+        hb_idle.addStretch( 1 )
+        hb_idle.addWidget( QLabel( 'Power save after' ), 0 )
+        hb_idle.addWidget( self.idle_secs, 0 )
+        hb_idle.addWidget( QLabel( 'below' ), 0 )
+        hb_idle.addWidget( self.idle_db, 0 )
+        hb_idle.addStretch( 1 )
+
+        # Create a checkbox to duck the gaps between words, and spinboxes
+        # for the level above which the input may be a voice and how long
+        # to hold the gain up after it stops.
+        self.duck = QCheckBox( 'Duck gaps' )
+        self.duck.setChecked( self.ducker.enabled )
+        self.duck_db = QSpinBox()
+        self.duck_db.setRange( -90, 0 )
+        self.duck_db.setSuffix( ' dB' )
+        self.duck_db.setValue( self.ducker.threshold_db )
+        self.duck_ms = QSpinBox()
+        self.duck_ms.setRange( 0, 2000 )
+        self.duck_ms.setSingleStep( 50 )
+        self.duck_ms.setSuffix( ' ms' )
+        self.duck_ms.setValue( self.ducker.hangover_ms )
+
+        # Put those in a row with labels
+        hb_duck = QHBoxLayout()
+        hb_duck.addStretch( 1 )
+        hb_duck.addWidget( self.duck, 0 )
+        hb_duck.addWidget( QLabel( 'voice above' ), 0 )
+        hb_duck.addWidget( self.duck_db, 0 )
+        hb_duck.addWidget( QLabel( 'hold' ), 0 )
+        hb_duck.addWidget( self.duck_ms, 0 )
+        hb_duck.addStretch( 1 )
+
+        # Create a heading for extra routes with a button to add one, and a
+        # box of rows for the extra routes of the last run, if any.
+        self.add_route = QPushButton( 'Add route' )
+        hb_routes = QHBoxLayout()
+        hb_routes.addWidget( QLabel( 'Extra routes' ), 0 )
+        hb_routes.addStretch( 1 )
+        hb_routes.addWidget( self.add_route, 0 )
+        self.routes_layout = QVBoxLayout()
+        self.route_rows = []
+        try :
+            routes = json.loads( self.settings.value( 'routes', '[]' ) )
+        except ValueError :
+            routes = [] # not written by us, ignore it
+        for in_dev_name, ot_dev_name, gain in routes :
+            self.new_route_row( in_dev_name, ot_dev_name, int( gain ) )
+
         # Stack all those up as this widget's layout
         vlayout = QVBoxLayout()
         vlayout.addLayout( hb_label )
         vlayout.addLayout( hb_combos )
         vlayout.addLayout( hb_volume )
+        vlayout.addLayout( hb_idle )
+        vlayout.addLayout( hb_duck )
+        vlayout.addLayout( hb_routes )
+        vlayout.addLayout( self.routes_layout )
         self.setLayout( vlayout )
 
         # end of _uic
 
+# Disconnect all the slots from a signal. PyQt raises TypeError if there
+# were none, which is fine.
+
+def disconnect_signal( signal ) :
+    try :
+        signal.disconnect()
+    except TypeError :
+        pass
+
 # Define a main window subclass so as to receive close events, mainly.
 # Initialization input is the settings object.
 
@@ -366,6 +987,43 @@ class MyMainWindow( QMainWindow ) :
         self.sidetone = SideToneWidget( self, the_settings )
         self.setCentralWidget( self.sidetone )
 
+        # Create a Format menu to pin the current format for the current
+        # devices, or choose another to pin, or to forget pinned formats.
+        # The choices depend on the devices, so are listed as it opens.
+        format_menu = self.menuBar().addMenu( 'Format' )
+        format_menu.addAction( 'Pin current format for these devices',
+                               self.sidetone.pin_format )
+        self.choose_menu = format_menu.addMenu( 'Pin format for these devices' )
+        self.choose_menu.aboutToShow.connect( self.list_format_choices )
+        format_menu.addAction( 'Clear pinned formats',
+                               self.sidetone.clear_pinned_formats )
+
+        # Create a Debug menu with a toggle to trace the audio path.
+        self.trace_action = QAction( 'Trace audio path', self )
+        self.trace_action.setCheckable( True )
+        self.trace_action.toggled.connect( self.sidetone.set_tracing )
+        debug_menu = self.menuBar().addMenu( 'Debug' )
+        debug_menu.addAction( self.trace_action )
+
+    # List the formats all the current devices support in the submenu of
+    # the Format menu, checking the one in use.
+
+    def list_format_choices( self ) :
+        self.choose_menu.clear()
+        plan = self.sidetone.plan
+        for rate, channels in self.sidetone.format_choices :
+            action = self.choose_menu.addAction(
+                FormatPlan( rate, channels, '' ).describe() )
+            action.setCheckable( True )
+            action.setChecked(
+                plan is not None
+                and ( plan.rate, plan.channels ) == ( rate, channels ) )
+            action.triggered.connect( functools.partial(
+                self.sidetone.pin_chosen_format, rate, channels ) )
+        if not self.sidetone.format_choices :
+            action = self.choose_menu.addAction( 'No 16-bit format in common' )
+            action.setEnabled( False )
+
     # Define a custom closeEvent handler. When the app is terminated
     # this is called. Just pass the call on to the closeEvent in the
     # sideTone widget. Note: I don't know why but this is entered twice.
@@ -376,12 +1034,19 @@ class MyMainWindow( QMainWindow ) :
         super().closeEvent( event ) # go ahead and close now
 
 def main():
+    import argparse
     import sys
     import icon
     # Start the application. This does a ton of Qt setup stuff.
     the_app = QApplication(sys.argv)
     QTest.qWait( 500 ) # idle for half a second before doing stuff
 
+    # Parse our own options from what Qt leaves of the command line.
+    parser = argparse.ArgumentParser( description='Sidetone' )
+    parser.add_argument( '--trace', metavar='FILE',
+        help='trace the audio path from startup, saving to FILE on exit' )
+    args = parser.parse_args( the_app.arguments()[1:] )
+
     '''
     With the application started, set the constants that define where
     the settings file is stored and what it is called. Then open the settings.
@@ -405,6 +1070,9 @@ def main():
     #the_settings.clear()
 
     main = MyMainWindow( the_settings )
+    if args.trace :
+        main.sidetone.trace_path = os.path.abspath( args.trace )
+        main.trace_action.setChecked( True )
     main.show()
     the_app.exec_()
     QTest.qWait( 500 ) # idle for half a second to let Python shut down
@@ -0,0 +1,467 @@
+'''
+
+Soak test: run Sidetone for hours against stand-in audio devices while
+switching devices, toggling mute, moving the volume and adding and
+removing routes, and watch for anything that grows without bound.
+
+    python3 soak.py --hours 4 --csv soak.csv
+
+The stand-in devices take the place of QAudioDeviceInfo, QAudioInput and
+QAudioOutput in sidetone.py. They keep time with Qt timers: an input
+makes a tone at the rate of its format and signals readyRead, and an
+output drains what was written to it at the same rate, reporting an
+underrun, as a real device does, when it runs dry. Everything else, the
+window, relay, mixer, power saving and format planning, is the real code.
+
+Every so often these are sampled:
+
+    rss        resident memory of the process, in KB
+    objects    Python objects tracked by the garbage collector, including
+               those frozen by QuietGC (see relay.py)
+    qobjects   QObjects under the main window
+    devices    stand-in audio devices still alive; like the real ones they
+               have no parent, so they are not among the qobjects
+    fds        open file descriptors
+    glitches   count of underruns and of blocks an output had no room for
+
+At the end, the samples after a warm-up are split into an earlier and a
+later half. The test fails if the later half of rss, objects, qobjects,
+devices or fds is higher than the earlier by more than a small allowance,
+or if glitches came faster in the later half than the earlier. Each
+sample is printed, and optionally written to a CSV file.
+
+To check the test itself, --leak makes the window keep every device it
+discards; the run then passes only if the soak fails on the devices.
+
+The window is not shown, so the test can run with QT_QPA_PLATFORM=offscreen.
+
+'''
+import argparse
+import csv
+import gc
+import os
+import random
+import resource
+import sys
+import tempfile
+import weakref
+
+from PyQt5.QtCore import (
+    Qt, QIODevice, QObject, QSettings, QTimer, QTime, pyqtSignal
+)
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtMultimedia import QAudio, QAudioFormat
+
+import sidetone
+
+# Stand-in devices tick every TICK_MS, moving that much audio.
+TICK_MS = 2
+
+# An output starts playing once it holds this many ticks of audio.
+PREFILL_TICKS = 2
+
+# The extra routes the churn keeps, at most.
+MAX_ROUTES = 3
+
+# How many stand-in inputs and outputs there are.
+STAND_IN_DEVICES = 3
+
+# What a stand-in device supports, and prefers.
+STAND_IN_RATES = [ 16000, 44100, 48000 ]
+STAND_IN_RATE = 48000
+
+class StandInDeviceInfo( object ) :
+    def __init__( self, name ) :
+        self.name = name
+    def deviceName( self ) :
+        return self.name
+    def isNull( self ) :
+        return False
+    def preferredFormat( self ) :
+        audio_format = QAudioFormat()
+        audio_format.setCodec( 'audio/pcm' )
+        audio_format.setSampleRate( STAND_IN_RATE )
+        audio_format.setChannelCount( 2 )
+        audio_format.setSampleSize( 16 )
+        audio_format.setSampleType( QAudioFormat.SignedInt )
+        audio_format.setByteOrder( QAudioFormat.LittleEndian )
+        return audio_format
+    def supportedSampleRates( self ) :
+        return list( STAND_IN_RATES )
+    def supportedChannelCounts( self ) :
+        return [ 1, 2 ]
+    def supportedSampleSizes( self ) :
+        return [ 16 ]
+    def supportedSampleTypes( self ) :
+        return [ QAudioFormat.SignedInt ]
+    def supportedByteOrders( self ) :
+        return [ QAudioFormat.LittleEndian ]
+
+    # The class methods sidetone.py calls on QAudioDeviceInfo.
+    @staticmethod
+    def availableDevices( mode ) :
+        kind = 'mic' if mode == QAudio.AudioInput else 'headset'
+        return [ StandInDeviceInfo( 'Stand-in {} {}'.format( kind, number ) )
+                 for number in range( 1, STAND_IN_DEVICES + 1 ) ]
+    @staticmethod
+    def defaultInputDevice() :
+        return StandInDeviceInfo( 'Stand-in mic 1' )
+    @staticmethod
+    def defaultOutputDevice() :
+        return StandInDeviceInfo( 'Stand-in headset 1' )
+
+# What the two kinds of stand-in device have in common: a format, a
+# volume, a buffer size, a state and error, and a timer. All that are
+# alive are in StandInDevice.alive, for counting.
+
+class StandInDevice( QObject ) :
+    stateChanged = pyqtSignal( int )
+    alive = weakref.WeakSet()
+
+    def __init__( self, info, audio_format ) :
+        super().__init__()
+        StandInDevice.alive.add( self )
+        self.info = info
+        self.audio_format = audio_format
+        self.tick_bytes = TICK_MS * audio_format.sampleRate() \
+                          * audio_format.channelCount() \
+                          * ( audio_format.sampleSize() // 8 ) // 1000
+        self.current_volume = 1.0
+        self.buffer_size = 4096
+        self.current_state = QAudio.StoppedState
+        self.current_error = QAudio.NoError
+        self.io = None
+        self.timer = QTimer( self )
+        self.timer.setTimerType( Qt.PreciseTimer )
+        self.timer.timeout.connect( self.tick )
+
+    def format( self ) :
+        return self.audio_format
+    def setVolume( self, volume ) :
+        self.current_volume = volume
+    def volume( self ) :
+        return self.current_volume
+    def setBufferSize( self, size ) :
+        self.buffer_size = size
+    def bufferSize( self ) :
+        return self.buffer_size
+    def state( self ) :
+        return self.current_state
+    def error( self ) :
+        return self.current_error
+
+    def set_state( self, state ) :
+        if state != self.current_state :
+            self.current_state = state
+            self.stateChanged.emit( int( state ) )
+
+    def stop( self ) :
+        self.timer.stop()
+        if self.io is not None :
+            self.io.close()
+            self.io = None
+        self.set_state( QAudio.StoppedState )
+    def reset( self ) :
+        self.stop()
+    def suspend( self ) :
+        if self.current_state in ( QAudio.ActiveState, QAudio.IdleState ) :
+            self.timer.stop()
+            self.set_state( QAudio.SuspendedState )
+    def resume( self ) :
+        if self.current_state == QAudio.SuspendedState :
+            self.timer.start( TICK_MS )
+            self.set_state( QAudio.ActiveState )
+
+# The QIODevice a stand-in input hands out. It reads as a square-wave
+# tone, as much as the input has made.
+
+class StandInSourceIO( QIODevice ) :
+    def __init__( self ) :
+        super().__init__()
+        self.pending = 0
+        self.tone = ( b'\x00\x10' * 24 + b'\x00\xf0' * 24 ) * 64
+    def isSequential( self ) :
+        return True
+    def bytesAvailable( self ) :
+        return self.pending + super().bytesAvailable()
+    def readData( self, max_bytes ) :
+        count = min( max_bytes, self.pending, len( self.tone ) )
+        self.pending -= count
+        return self.tone[ : count ]
+    def writeData( self, data ) :
+        return -1
+
+class StandInAudioInput( StandInDevice ) :
+    def start( self ) :
+        self.io = StandInSourceIO()
+        self.io.open( QIODevice.ReadOnly | QIODevice.Unbuffered )
+        self.timer.start( TICK_MS )
+        self.set_state( QAudio.ActiveState )
+        return self.io
+    def bytesReady( self ) :
+        return self.io.pending if self.io is not None else 0
+    def tick( self ) :
+        self.io.pending = min( self.io.pending + self.tick_bytes,
+                               self.buffer_size )
+        self.io.readyRead.emit()
+
+# The QIODevice a stand-in output hands out. It takes as much as fits in
+# the output's buffer.
+
+class StandInSinkIO( QIODevice ) :
+    def __init__( self, output ) :
+        super().__init__()
+        self.output = output
+    def isSequential( self ) :
+        return True
+    def readData( self, max_bytes ) :
+        return b''
+    def writeData( self, data ) :
+        return self.output.take( len( data ) )
+
+class StandInAudioOutput( StandInDevice ) :
+    def start( self ) :
+        self.io = StandInSinkIO( self )
+        self.io.open( QIODevice.WriteOnly | QIODevice.Unbuffered )
+        self.level = 0
+        self.timer.start( TICK_MS )
+        self.set_state( QAudio.IdleState )
+        return self.io
+    def bytesFree( self ) :
+        return self.buffer_size - self.level
+    def take( self, count ) :
+        if self.current_state == QAudio.SuspendedState :
+            return 0
+        count = min( count, self.buffer_size - self.level )
+        self.level += count
+        return count
+    def tick( self ) :
+        if self.current_state == QAudio.IdleState :
+            if self.level >= PREFILL_TICKS * self.tick_bytes :
+                self.current_error = QAudio.NoError
+                self.set_state( QAudio.ActiveState )
+        elif self.level >= self.tick_bytes :
+            self.level -= self.tick_bytes
+        else :
+            self.level = 0
+            self.current_error = QAudio.UnderrunError
+            self.set_state( QAudio.IdleState )
+
+# Measure the process.
+
+def resident_kb() :
+    try :
+        with open( '/proc/self/statm' ) as statm :
+            pages = int( statm.read().split()[1] )
+        return pages * resource.getpagesize() // 1024
+    except OSError :
+        # No /proc; the peak resident size is the best there is.
+        return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+def open_fds() :
+    for fd_dir in ( '/proc/self/fd', '/dev/fd' ) :
+        if os.path.isdir( fd_dir ) :
+            return len( os.listdir( fd_dir ) )
+    return 0
+
+METRICS = [ 'rss', 'objects', 'qobjects', 'devices', 'fds', 'glitches' ]
+
+# For each metric that must not grow, how much the later half may exceed
+# the earlier: the larger of an absolute amount and a fraction.
+ALLOWANCE = {
+    'rss' : ( 2048, 0.05 ),
+    'objects' : ( 1000, 0.02 ),
+    'qobjects' : ( 5, 0.0 ),
+    'devices' : ( 2, 0.0 ),
+    'fds' : ( 2, 0.0 ),
+}
+
+# Glitches may come this much faster in the later half, per minute, or by
+# this fraction, whichever is larger.
+GLITCH_ALLOWANCE = ( 1.0, 0.5 )
+
+def median( values ) :
+    values = sorted( values )
+    middle = len( values ) // 2
+    if len( values ) % 2 :
+        return values[ middle ]
+    return ( values[ middle - 1 ] + values[ middle ] ) / 2
+
+# Judge the samples, each a dict with 'secs' and the METRICS. Skip the
+# warm-up, compare the halves, and return a list of failure messages.
+
+def judge( samples, warmup ) :
+    samples = [ sample for sample in samples if sample['secs'] >= warmup ]
+    if len( samples ) < 4 :
+        return [ 'too few samples after the warm-up to judge' ]
+    half = len( samples ) // 2
+    earlier, later = samples[ : half ], samples[ half : ]
+    failures = []
+    for metric, ( absolute, fraction ) in ALLOWANCE.items() :
+        before = median( [ sample[ metric ] for sample in earlier ] )
+        after = median( [ sample[ metric ] for sample in later ] )
+        allowed = max( absolute, before * fraction )
+        if after - before > allowed :
+            failures.append( '{} grew from {} to {} (allowed {})'.format(
+                metric, before, after, allowed ) )
+    def rate( part ) :
+        minutes = ( part[-1]['secs'] - part[0]['secs'] ) / 60.0
+        if minutes <= 0 :
+            return 0.0
+        return ( part[-1]['glitches'] - part[0]['glitches'] ) / minutes
+    before, after = rate( earlier ), rate( later )
+    absolute, fraction = GLITCH_ALLOWANCE
+    if after - before > max( absolute, before * fraction ) :
+        failures.append(
+            'glitches rose from {:.1f} to {:.1f} a minute'.format( before, after ) )
+    return failures
+
+# Drive the window: at every churn tick do one random thing a user might,
+# and at every sample tick record the measurements.
+
+class Soak( object ) :
+    def __init__( self, window, args ) :
+        self.window = window
+        self.sidetone = window.sidetone
+        self.random = random.Random( args.seed )
+        self.samples = []
+        self.actions = 0
+        self.clock = QTime()
+        self.clock.start()
+        self.writer = None
+        if args.csv :
+            self.csv_file = open( args.csv, 'w', newline='' )
+            self.writer = csv.writer( self.csv_file )
+            self.writer.writerow( [ 'secs', 'actions' ] + METRICS )
+        print( '{:>8} {:>8} {:>8} {:>8} {:>9} {:>8} {:>5} {:>9}'.format(
+            'secs', 'actions', *METRICS ) )
+
+    def churn( self ) :
+        sidetone = self.sidetone
+        action = self.random.choice(
+            [ 'input', 'output', 'mute', 'mute', 'volume', 'volume', 'route' ] )
+        if action == 'input' :
+            sidetone.cb_inputs.setCurrentIndex(
+                self.random.randrange( sidetone.cb_inputs.count() ) )
+        elif action == 'output' :
+            sidetone.cb_otputs.setCurrentIndex(
+                self.random.randrange( sidetone.cb_otputs.count() ) )
+        elif action == 'mute' :
+            sidetone.mute.toggle()
+        elif action == 'volume' :
+            sidetone.volume.setValue( self.random.randrange( 101 ) )
+        elif sidetone.route_rows and ( len( sidetone.route_rows ) >= MAX_ROUTES
+                                       or self.random.random() < 0.5 ) :
+            self.random.choice( sidetone.route_rows ).remove.click()
+        else :
+            sidetone.add_route.click()
+            row = sidetone.route_rows[-1]
+            row.cb_input.setCurrentIndex(
+                self.random.randrange( row.cb_input.count() ) )
+            row.gain.setValue( self.random.randrange( 101 ) )
+        self.actions += 1
+
+    def sample( self ) :
+        gc.collect()
+        sample = {
+            'secs' : self.clock.elapsed() / 1000.0,
+            'rss' : resident_kb(),
+            # get_objects() leaves out the objects gc.freeze() has frozen.
+            'objects' : len( gc.get_objects() ) + gc.get_freeze_count(),
+            'qobjects' : len( self.window.findChildren( QObject ) ),
+            'devices' : len( StandInDevice.alive ),
+            'fds' : open_fds(),
+            'glitches' : self.sidetone.glitch_count()
+        }
+        self.samples.append( sample )
+        print( '{:>8.0f} {:>8} {:>8} {:>8} {:>9} {:>8} {:>5} {:>9}'.format(
+            sample['secs'], self.actions,
+            *[ sample[ metric ] for metric in METRICS ] ) )
+        if self.writer is not None :
+            self.writer.writerow( [ sample['secs'], self.actions ]
+                                  + [ sample[ metric ] for metric in METRICS ] )
+            self.csv_file.flush()
+
+def main() :
+    parser = argparse.ArgumentParser(
+        description='Soak-test Sidetone against stand-in audio devices' )
+    parser.add_argument( '--hours', type=float, default=1.0,
+        help='how long to run (default 1)' )
+    parser.add_argument( '--churn-ms', type=int, default=250,
+        help='ms between user actions (default 250)' )
+    parser.add_argument( '--sample-secs', type=float, default=30.0,
+        help='seconds between samples (default 30)' )
+    parser.add_argument( '--warmup-secs', type=float, default=None,
+        help='seconds of samples to ignore (default a tenth of the run)' )
+    parser.add_argument( '--seed', type=int, default=1,
+        help='seed for the random actions' )
+    parser.add_argument( '--csv', metavar='FILE',
+        help='also write the samples to FILE' )
+    parser.add_argument( '--leak', action='store_true',
+        help='keep every discarded device, to check that the soak fails' )
+    args = parser.parse_args()
+    duration = args.hours * 3600.0
+    warmup = args.warmup_secs if args.warmup_secs is not None \
+             else duration / 10
+
+    # Put the stand-ins in place of the Qt audio classes.
+    sidetone.QAudioDeviceInfo = StandInDeviceInfo
+    sidetone.QAudioInput = StandInAudioInput
+    sidetone.QAudioOutput = StandInAudioOutput
+
+    # For --leak, keep every device the window lets go of.
+    leaked = []
+    if args.leak :
+        discard_devices = sidetone.SideToneWidget.discard_devices
+        def leaky_discard_devices( widget ) :
+            devices = [ widget.input_device, widget.otput_device ] \
+                      + widget.extra_inputs + widget.extra_otputs
+            leaked.extend( device for device in devices if device is not None )
+            discard_devices( widget )
+        sidetone.SideToneWidget.discard_devices = leaky_discard_devices
+
+    the_app = QApplication( sys.argv[ : 1 ] )
+    import icon
+
+    # Use throwaway settings, not the user's. Power save after 1 second,
+    # so that mute makes the devices suspend and resume too.
+    settings_dir = tempfile.TemporaryDirectory()
+    the_settings = QSettings(
+        os.path.join( settings_dir.name, 'soak.ini' ), QSettings.IniFormat )
+    the_settings.setValue( 'volume', 50 )
+    the_settings.setValue( 'mute_status', 0 )
+    the_settings.setValue( 'idle_secs', 1 )
+
+    window = sidetone.MyMainWindow( the_settings )
+    soak = Soak( window, args )
+    churn_timer = QTimer()
+    churn_timer.timeout.connect( soak.churn )
+    churn_timer.start( args.churn_ms )
+    sample_timer = QTimer()
+    sample_timer.timeout.connect( soak.sample )
+    sample_timer.start( int( args.sample_secs * 1000 ) )
+    QTimer.singleShot( int( duration * 1000 ), the_app.quit )
+    soak.sample()
+    the_app.exec_()
+    churn_timer.stop()
+    sample_timer.stop()
+    window.close()
+
+    failures = judge( soak.samples, warmup )
+    if args.leak :
+        caught = [ failure for failure in failures
+                   if failure.startswith( 'devices grew' ) ]
+        if caught :
+            print( 'PASS: the leak of {} devices was caught: {}'.format(
+                len( leaked ), caught[0] ) )
+            return 0
+        print( 'FAIL: the leak of {} devices was not caught'.format( len( leaked ) ) )
+        return 1
+    for failure in failures :
+        print( 'FAIL:', failure )
+    if not failures :
+        print( 'PASS: nothing grew over {} samples'.format( len( soak.samples ) ) )
+    return 1 if failures else 0
+
+if __name__ == '__main__' :
+    sys.exit( main() )
@@ -0,0 +1,131 @@
+'''
+
+Tests of convert.py: every format to and from INT16, and the details of
+packed 24-bit samples, byte order and dither.
+
+    python3 -m pytest -q
+
+'''
+import numpy
+import pytest
+
+from convert import (
+    ALL_FORMATS, INT16, SampleConverter, SampleFormat, block_dtype, sample_bytes
+)
+from relay import Block
+
+SAMPLES = 480
+
+# Noise at a voice-like level, plus both extremes, zero and minus one.
+def int16_block() :
+    samples = numpy.random.default_rng( 1 ).normal( 0, 8000, SAMPLES )
+    samples = samples.clip( -32768, 32767 ).astype( numpy.int16 )
+    samples[ : 4 ] = [ -32768, 32767, 0, -1 ]
+    block = Block( SAMPLES * 2, numpy.int16 )
+    block.samples[:] = samples
+    return block
+
+# Copy a converter's output into a block as the relay would make for it.
+def relay_block( out, sample_format ) :
+    block = Block( len( out.data ), block_dtype( sample_format ) )
+    block.data[:] = out.data
+    return block
+
+# How far a round trip through each format may be off, in 16-bit steps:
+# none for 16-bit, one for the dither of wider formats, and for 8-bit,
+# one 8-bit step of dither and half of one of rounding.
+def tolerance( sample_format ) :
+    if sample_format.bits == 16 :
+        return 0
+    if sample_format.bits == 8 :
+        return 256 + 128
+    return 1
+
+@pytest.mark.parametrize( 'sample_format', ALL_FORMATS, ids=str )
+def test_round_trip( sample_format ) :
+    source = int16_block()
+    out = SampleConverter( INT16, sample_format, SAMPLES ).stage( source )
+    assert len( out.data ) == SAMPLES * sample_bytes( sample_format )
+    back = SampleConverter( sample_format, INT16, SAMPLES ).stage(
+        relay_block( out, sample_format ) )
+    error = numpy.abs( back.samples.astype( int ) - source.samples.astype( int ) )
+    assert error.max() <= tolerance( sample_format )
+
+def test_same_format_passes_block_through() :
+    source = int16_block()
+    assert SampleConverter( INT16, INT16, SAMPLES ).stage( source ) is source
+
+def convert_one( value, sample_format ) :
+    source = Block( 2, numpy.int16 )
+    source.samples[0] = value
+    return bytes( SampleConverter( INT16, sample_format, 1 ).stage( source ).data )
+
+def test_packed_24_bit_bytes() :
+    # -2 in 16 bits is -512 in 24: 0xFFFE00, low byte first when little.
+    assert convert_one( -2, SampleFormat( 24, 'int', True ) ) == b'\x00\xfe\xff'
+    assert convert_one( -2, SampleFormat( 24, 'int', False ) ) == b'\xff\xfe\x00'
+    # Unsigned, silence is 0x800000.
+    assert convert_one( 0, SampleFormat( 24, 'uint', False ) ) == b'\x80\x00\x00'
+
+def test_packed_24_bit_sign_extension() :
+    samples = [ -8388608, -1, 0, 1, 8388607 ]
+    data = b''.join( ( value & 0xFFFFFF ).to_bytes( 3, 'little' )
+                     for value in samples )
+    block = Block( len( data ), numpy.uint8 )
+    block.data[:] = data
+    converter = SampleConverter(
+        SampleFormat( 24, 'int', True ), SampleFormat( 32, 'int', True ),
+        len( samples ) )
+    assert list( converter.stage( block ).samples ) == \
+        [ value * 256 for value in samples ]
+
+def test_byte_swap() :
+    source = int16_block()
+    big = SampleFormat( 16, 'int', False )
+    converter = SampleConverter( INT16, big, SAMPLES )
+    assert converter.convert == converter.swap
+    out = converter.stage( source )
+    assert bytes( out.data ) == source.samples.astype( '>i2' ).tobytes()
+    swapped = SampleConverter( SampleFormat( 24, 'int', False ),
+                               SampleFormat( 24, 'int', True ), 1 )
+    block = Block( 3, numpy.uint8 )
+    block.data[:] = b'\x01\x02\x03'
+    assert bytes( swapped.stage( block ).data ) == b'\x03\x02\x01'
+
+def test_other_formats() :
+    assert convert_one( 0, SampleFormat( 8, 'uint', True ) ) in (
+        b'\x7f', b'\x80', b'\x81' )
+    assert convert_one( 16384, SampleFormat( 32, 'float', False ) ) == \
+        b'\x3f\x00\x00\x00'
+    assert convert_one( 32767, SampleFormat( 32, 'int', False ) ) == \
+        b'\x7f\xff\x00\x00'
+
+def test_dither_only_when_bits_are_lost() :
+    def dither( source, target ) :
+        return SampleConverter( source, target, 1 ).dither
+    assert dither( INT16, SampleFormat( 8, 'int', True ) )
+    assert dither( SampleFormat( 24, 'int', True ), INT16 )
+    assert dither( SampleFormat( 32, 'float', True ), INT16 )
+    assert not dither( INT16, SampleFormat( 24, 'int', True ) )
+    assert not dither( INT16, SampleFormat( 32, 'float', True ) )
+    assert not dither( SampleFormat( 32, 'float', True ),
+                       SampleFormat( 32, 'int', True ) )
+
+def test_dither_is_triangular_and_unbiased() :
+    # A steady value halfway between two 8-bit steps comes out as a mix
+    # of the steps around it, averaging the value, never more than one
+    # step off either side.
+    samples = 100000
+    source = Block( samples * 2, numpy.int16 )
+    source.samples[:] = 128
+    out = SampleConverter( INT16, SampleFormat( 8, 'int', True ), samples ) \
+              .stage( source ).samples.astype( int )
+    assert set( numpy.unique( out ) ) <= { -1, 0, 1, 2 }
+    assert abs( out.mean() - 0.5 ) < 0.02
+
+def test_full_scale_float_to_int32_does_not_wrap() :
+    block = Block( 12, numpy.float32 )
+    block.samples[:] = [ 1.0, -1.0, 2.0 ]
+    out = SampleConverter( SampleFormat( 32, 'float', True ),
+                           SampleFormat( 32, 'int', True ), 3 ).stage( block )
+    assert list( out.samples ) == [ 2147483647, -2147483648, 2147483647 ]
@@ -0,0 +1,112 @@
+'''
+
+Tests of formats.py: planning a format, the formats the user may pin,
+and storing pins in the settings.
+
+    python3 -m pytest -q
+
+They need QtMultimedia for QAudioFormat, and are skipped without it.
+
+'''
+import pytest
+
+# QtMultimedia can be installed but fail to load its audio libraries.
+pytest.importorskip( 'PyQt5.QtMultimedia', exc_type=ImportError )
+
+from PyQt5.QtCore import QSettings
+from PyQt5.QtMultimedia import QAudioFormat
+
+from convert import SampleFormat
+from formats import (
+    DeviceCaps, FormatPlan, clear_pins, common_formats, load_pins,
+    plan_format, sample_format, save_pin
+)
+
+RATES = [ 16000, 44100, 48000 ]
+
+def caps( name, preferred_rate=48000, rates=RATES, channels=( 1, 2 ),
+          sizes=( 8, 16 ) ) :
+    return DeviceCaps( name, rates, channels, sizes, preferred_rate, 2 )
+
+def test_native_rate_of_all_devices() :
+    plan = plan_format( [ caps( 'mic' ), caps( 'headset' ) ] )
+    assert ( plan.rate, plan.channels ) == ( 48000, 1 )
+    assert plan.reason == 'native rate of all devices'
+
+def test_tie_between_native_rates_takes_the_lowest_for_voice() :
+    plan = plan_format( [ caps( 'mic', 44100 ), caps( 'headset', 48000 ) ] )
+    assert plan.rate == 44100
+    assert plan.reason == 'native rate of 1 of 2 devices'
+
+def test_more_devices_native_wins_over_lower_rate() :
+    plan = plan_format( [ caps( 'mic', 44100 ), caps( 'headset', 48000 ),
+                          caps( 'speaker', 48000 ) ] )
+    assert plan.rate == 48000
+
+def test_no_native_rate_takes_the_lowest_good_for_voice() :
+    plan = plan_format( [ caps( 'mic', 96000 ), caps( 'headset', 96000 ) ] )
+    assert plan.rate == 16000
+    assert plan.reason.startswith( 'no native rate in common' )
+
+def test_only_rates_below_voice_takes_the_highest() :
+    rates = [ 8000, 11025 ]
+    plan = plan_format( [ caps( 'mic', 96000, rates ),
+                          caps( 'headset', 96000, rates ) ] )
+    assert plan.rate == 11025
+
+def test_fewest_channels_in_common() :
+    plan = plan_format( [ caps( 'mic', channels=( 2, 4 ) ),
+                          caps( 'headset', channels=( 1, 2 ) ) ] )
+    assert plan.channels == 2
+
+@pytest.mark.parametrize( 'devices', [
+    [ caps( 'mic', rates=[ 44100 ] ), caps( 'headset', rates=[ 48000 ] ) ],
+    [ caps( 'mic', channels=( 1, ) ), caps( 'headset', channels=( 2, ) ) ],
+    [ caps( 'mic', sizes=( 24, ) ), caps( 'headset' ) ],
+], ids=[ 'rate', 'channels', 'size' ] )
+def test_nothing_in_common( devices ) :
+    assert plan_format( devices ) is None
+    assert common_formats( devices ) == []
+
+def test_usable_pin_wins() :
+    plan = plan_format( [ caps( 'mic' ), caps( 'headset' ) ],
+                        { 'headset' : ( 16000, 2 ) } )
+    assert ( plan.rate, plan.channels ) == ( 16000, 2 )
+    assert plan.reason == 'pinned for headset'
+
+def test_unusable_pin_is_noted() :
+    plan = plan_format( [ caps( 'mic' ), caps( 'headset' ) ],
+                        { 'mic' : ( 96000, 1 ) } )
+    assert plan.rate == 48000
+    assert 'pin for mic not usable' in plan.reason
+
+def test_buffer_is_whole_frames_of_the_duration() :
+    assert FormatPlan( 48000, 1, '' ).buffer_bytes() == 212
+    assert FormatPlan( 44100, 2, '' ).buffer_bytes() % 4 == 0
+
+def test_common_formats() :
+    devices = [ caps( 'mic', rates=[ 16000, 48000 ] ),
+                caps( 'headset', channels=( 2, ) ) ]
+    assert common_formats( devices ) == [ ( 16000, 2 ), ( 48000, 2 ) ]
+    assert common_formats( [ caps( 'mic', sizes=( 24, ) ) ] ) == []
+
+def test_pins_in_settings( tmp_path ) :
+    settings = QSettings( str( tmp_path / 'pins.ini' ), QSettings.IniFormat )
+    names = [ 'USB Audio/Headset', 'Mic' ]
+    save_pin( settings, names[0], FormatPlan( 16000, 1, '' ) )
+    settings.setValue( 'pinned_format/Mic', 'not a pin' )
+    assert load_pins( settings, names ) == { names[0] : ( 16000, 1 ) }
+    clear_pins( settings )
+    assert load_pins( settings, names ) == {}
+
+def test_sample_format() :
+    audio_format = QAudioFormat()
+    audio_format.setSampleSize( 24 )
+    audio_format.setSampleType( QAudioFormat.SignedInt )
+    audio_format.setByteOrder( QAudioFormat.BigEndian )
+    assert sample_format( audio_format ) == SampleFormat( 24, 'int', False )
+    audio_format.setSampleType( QAudioFormat.Float )
+    assert sample_format( audio_format ) is None
+    audio_format.setSampleSize( 32 )
+    audio_format.setByteOrder( QAudioFormat.LittleEndian )
+    assert sample_format( audio_format ) == SampleFormat( 32, 'float', True )
@@ -0,0 +1,188 @@
+'''
+
+Tests of idle.py: when the IdleSuspender suspends and resumes, and what
+it measures of each suspension.
+
+    python3 -m pytest -q
+
+'''
+import numpy
+import pytest
+
+import idle
+from idle import ACTIVE, MUTED, SILENT, IdleSuspender
+from relay import Block
+
+SAMPLES = 106
+
+# Stand-in for the time module, whose clocks move only when told to.
+class FakeTime( object ) :
+    def __init__( self ) :
+        self.wall = 1000.0
+        self.cpu = 10.0
+    def perf_counter( self ) :
+        return self.wall
+    def process_time( self ) :
+        return self.cpu
+    def sleep( self, secs, cpu=0.0 ) :
+        self.wall += secs
+        self.cpu += cpu
+
+@pytest.fixture
+def clock( monkeypatch ) :
+    clock = FakeTime()
+    monkeypatch.setattr( idle, 'time', clock )
+    return clock
+
+# An IdleSuspender that records its calls to suspend and resume.
+@pytest.fixture
+def suspender( clock ) :
+    calls = []
+    suspender = IdleSuspender(
+        lambda state : calls.append( ( 'suspend', state ) ),
+        lambda : calls.append( ( 'resume', ) ),
+        idle_secs=10, threshold_db=-50 )
+    suspender.calls = calls
+    return suspender
+
+# A block of a steady tone at the given level in dBFS (as mean square).
+def block_at( db ) :
+    block = Block( SAMPLES * 2, numpy.int16 )
+    amplitude = 32768 * 10 ** ( db / 20 ) * 2 ** 0.5
+    block.samples[:] = amplitude * numpy.sin( numpy.arange( SAMPLES ) * 0.5 )
+    return block
+
+def test_active_until_silent_long_enough( suspender, clock ) :
+    clock.sleep( 9.9 )
+    suspender.tick()
+    assert suspender.state == ACTIVE
+    clock.sleep( 0.1 )
+    suspender.tick()
+    assert suspender.state == SILENT
+    assert suspender.calls == [ ( 'suspend', SILENT ) ]
+
+def test_loud_block_keeps_it_active( suspender, clock ) :
+    clock.sleep( 9 )
+    block = block_at( -30 )
+    assert suspender.stage( block ) is block
+    clock.sleep( 9 )
+    suspender.tick()
+    assert suspender.state == ACTIVE
+
+def test_quiet_block_is_silence( suspender, clock ) :
+    clock.sleep( 9 )
+    suspender.stage( block_at( -60 ) )
+    clock.sleep( 1 )
+    suspender.tick()
+    assert suspender.state == SILENT
+
+def test_silent_then_muted( suspender, clock ) :
+    clock.sleep( 10 )
+    suspender.tick()
+    suspender.set_muted( True )
+    clock.sleep( 9 )
+    suspender.tick()
+    assert suspender.state == SILENT
+    clock.sleep( 1 )
+    suspender.tick()
+    assert suspender.state == MUTED
+    suspender.tick()
+    assert suspender.calls == [ ( 'suspend', SILENT ), ( 'suspend', MUTED ) ]
+
+def test_muted_long_enough_though_loud( suspender, clock ) :
+    suspender.set_muted( True )
+    clock.sleep( 9 )
+    suspender.stage( block_at( -30 ) )
+    clock.sleep( 1 )
+    suspender.tick()
+    assert suspender.state == MUTED
+
+def test_loud_block_resumes_from_silence( suspender, clock ) :
+    clock.sleep( 10 )
+    suspender.tick()
+    suspender.stage( block_at( -30 ) )
+    assert suspender.state == ACTIVE
+    assert suspender.calls[-1] == ( 'resume', )
+
+@pytest.mark.parametrize( 'state', [ SILENT, MUTED ] )
+def test_loud_block_does_not_resume_while_muted( suspender, clock, state ) :
+    clock.sleep( 10 )
+    suspender.tick()
+    suspender.set_muted( True )
+    if state == MUTED :
+        clock.sleep( 10 )
+        suspender.tick()
+    suspender.stage( block_at( -30 ) )
+    assert suspender.state == state
+    assert ( 'resume', ) not in suspender.calls
+
+@pytest.mark.parametrize( 'state', [ SILENT, MUTED ] )
+def test_unmute_resumes( suspender, clock, state ) :
+    suspender.set_muted( state == MUTED )
+    clock.sleep( 10 )
+    suspender.tick()
+    assert suspender.state == state
+    suspender.set_muted( False )
+    assert suspender.state == ACTIVE
+    assert suspender.calls[-1] == ( 'resume', )
+    # Unmuting counts as activity, so silence waits its full period.
+    clock.sleep( 9 )
+    suspender.tick()
+    assert suspender.state == ACTIVE
+
+def test_unmute_while_active_does_not_resume( suspender, clock ) :
+    suspender.set_muted( True )
+    suspender.set_muted( False )
+    assert suspender.calls == []
+
+def test_never_when_idle_secs_is_zero( suspender, clock ) :
+    suspender.idle_secs = 0
+    suspender.set_muted( True )
+    clock.sleep( 1000 )
+    suspender.tick()
+    assert suspender.state == ACTIVE
+
+def test_set_threshold( suspender, clock ) :
+    suspender.set_threshold( -20 )
+    clock.sleep( 9 )
+    suspender.stage( block_at( -30 ) )
+    clock.sleep( 1 )
+    suspender.tick()
+    assert suspender.state == SILENT
+
+def test_reset_forgets_suspension( suspender, clock ) :
+    clock.sleep( 10 )
+    suspender.tick()
+    suspender.reset()
+    assert suspender.state == ACTIVE
+    clock.sleep( 9 )
+    suspender.tick()
+    assert suspender.state == ACTIVE
+    # Nothing is outstanding, so unmuting resumes nothing.
+    suspender.set_muted( True )
+    suspender.set_muted( False )
+    assert suspender.calls == [ ( 'suspend', SILENT ) ]
+    assert suspender.resumed() is None
+
+def test_resume_measures_the_suspension( suspender, clock ) :
+    clock.sleep( 10 )
+    suspender.tick()
+    clock.sleep( 20, cpu=0.1 )
+    suspender.stage( block_at( -30 ) )
+    assert suspender.last_idle_secs == pytest.approx( 20 )
+    assert suspender.last_idle_cpu == pytest.approx( 0.5 )
+    clock.sleep( 0.025 )
+    assert suspender.resumed() == pytest.approx( 25 )
+    assert suspender.last_resume_ms == pytest.approx( 25 )
+    # Only once per resume.
+    assert suspender.resumed() is None
+
+def test_silent_then_muted_measures_from_the_first_suspension( suspender, clock ) :
+    clock.sleep( 10 )
+    suspender.tick()
+    suspender.set_muted( True )
+    clock.sleep( 10 )
+    suspender.tick()
+    clock.sleep( 5 )
+    suspender.set_muted( False )
+    assert suspender.last_idle_secs == pytest.approx( 15 )
@@ -0,0 +1,159 @@
+'''
+
+Tests of mixer.py: lanes assembling blocks and dropping what runs ahead,
+and the mix of every input into every output.
+
+    python3 -m pytest -q
+
+'''
+from types import SimpleNamespace
+
+import numpy
+import pytest
+
+from mixer import LANE_BLOCKS, MAX_LAG_BLOCKS, Lane, RouteMixer
+
+SAMPLES = 8
+BLOCK_BYTES = SAMPLES * 2
+
+def samples_bytes( values ) :
+    return numpy.array( values, dtype=numpy.int16 ).tobytes()
+
+def steady( value ) :
+    return samples_bytes( [ value ] * SAMPLES )
+
+# Stand-in for the QIODevice of an input: each read returns the next of
+# the chunks given to it, then an empty read when there are no more.
+class FakeSource( object ) :
+    def __init__( self ) :
+        self.chunks = []
+    def read( self, max_bytes ) :
+        if not self.chunks :
+            return b''
+        chunk = self.chunks.pop( 0 )
+        assert len( chunk ) <= max_bytes
+        return chunk
+
+# Stand-in for the QIODevice of an output, taking at most "room" bytes
+# of each write.
+class FakeSink( object ) :
+    def __init__( self, room=None ) :
+        self.room = room
+        self.blocks = []
+    def write( self, data ) :
+        written = len( data ) if self.room is None else min( self.room, len( data ) )
+        self.blocks.append( numpy.frombuffer(
+            bytes( data[ : written ] ), dtype=numpy.int16 ).tolist() )
+        return written
+
+def test_lane_assembles_blocks_from_parts() :
+    lane = Lane( FakeSource(), BLOCK_BYTES )
+    data = samples_bytes( range( SAMPLES ) )
+    assert not lane.fill( data[ : 6 ] )
+    assert lane.take() is None
+    assert lane.fill( data[ 6 : ] )
+    assert lane.take().samples.tolist() == list( range( SAMPLES ) )
+    assert lane.take() is None
+
+def test_lane_keeps_blocks_in_order() :
+    lane = Lane( FakeSource(), BLOCK_BYTES )
+    for value in range( MAX_LAG_BLOCKS ) :
+        lane.fill( steady( value ) )
+    for value in range( MAX_LAG_BLOCKS ) :
+        assert lane.take().samples[0] == value
+    assert lane.dropped == 0
+
+def test_lane_drops_the_oldest_beyond_max_lag() :
+    lane = Lane( FakeSource(), BLOCK_BYTES )
+    blocks = MAX_LAG_BLOCKS + LANE_BLOCKS + 1
+    for value in range( blocks ) :
+        lane.fill( steady( value ) )
+    assert lane.waiting == MAX_LAG_BLOCKS
+    assert lane.dropped == blocks - MAX_LAG_BLOCKS
+    for value in range( blocks - MAX_LAG_BLOCKS, blocks ) :
+        assert lane.take().samples[0] == value
+    assert lane.take() is None
+
+def make_mixer( inputs, outputs, room=None ) :
+    sources = [ FakeSource() for i in range( inputs ) ]
+    sinks = [ FakeSink( room ) for i in range( outputs ) ]
+    return RouteMixer( sources, sinks, BLOCK_BYTES ), sources, sinks
+
+def test_block_size_is_whole_samples() :
+    mixer, sources, sinks = make_mixer( 1, 1 )
+    assert RouteMixer( sources, sinks, BLOCK_BYTES + 1 ).block_bytes == BLOCK_BYTES
+
+def test_routes_start_silent() :
+    mixer, sources, sinks = make_mixer( 1, 1 )
+    sources[0].chunks = [ steady( 1000 ) ]
+    mixer.relay( 0 )
+    assert sinks[0].blocks == [ [ 0 ] * SAMPLES ]
+
+def test_gain_matrix() :
+    mixer, sources, sinks = make_mixer( 2, 2 )
+    mixer.set_gains( [ [ 1.0, 0.5 ], [ 0.0, 2.0 ] ] )
+    sources[1].chunks = [ steady( 100 ) ]
+    mixer.relay( 1 )
+    assert sinks[0].blocks == []
+    sources[0].chunks = [ steady( 1000 ) ]
+    mixer.relay( 0 )
+    assert sinks[0].blocks == [ [ 1050 ] * SAMPLES ]
+    assert sinks[1].blocks == [ [ 200 ] * SAMPLES ]
+
+def test_lane_with_nothing_waiting_is_silence() :
+    mixer, sources, sinks = make_mixer( 2, 1 )
+    mixer.set_gains( [ [ 1.0, 1.0 ] ] )
+    sources[1].chunks = [ steady( 100 ) ]
+    mixer.relay( 1 )
+    sources[0].chunks = [ steady( 1000 ), steady( 1000 ) ]
+    mixer.relay( 0 )
+    assert sinks[0].blocks == [ [ 1100 ] * SAMPLES, [ 1000 ] * SAMPLES ]
+
+def test_mix_is_clipped_to_16_bits() :
+    mixer, sources, sinks = make_mixer( 2, 1 )
+    mixer.set_gains( [ [ 1.0, 1.0 ] ] )
+    sources[1].chunks = [ samples_bytes( [ 30000, -30000 ] * ( SAMPLES // 2 ) ) ]
+    mixer.relay( 1 )
+    sources[0].chunks = [ samples_bytes( [ 30000, -30000 ] * ( SAMPLES // 2 ) ) ]
+    mixer.relay( 0 )
+    assert sinks[0].blocks == [ [ 32767, -32768 ] * ( SAMPLES // 2 ) ]
+
+def test_short_writes_are_counted() :
+    mixer, sources, sinks = make_mixer( 1, 2, room=BLOCK_BYTES // 2 )
+    sources[0].chunks = [ steady( 0 ), steady( 0 ) ]
+    mixer.relay( 0 )
+    assert mixer.short_writes == 4
+
+# route_gains() is a method of the window, given here only what it uses.
+
+class FakeCheckBox( object ) :
+    def __init__( self, checked ) :
+        self.checked = checked
+    def isChecked( self ) :
+        return self.checked
+
+class FakeRouteRow( object ) :
+    def __init__( self, *route ) :
+        self.values = list( route )
+    def route( self ) :
+        return self.values
+
+def route_gains( muted, volume, rows ) :
+    # QtMultimedia can be installed but fail to load its audio libraries.
+    sidetone = pytest.importorskip( 'sidetone', exc_type=ImportError )
+    window = SimpleNamespace(
+        mix_input_names=[ 'Mic', 'USB' ],
+        mix_otput_names=[ 'Phones', 'Speaker' ],
+        mute=FakeCheckBox( muted ),
+        route_rows=[ FakeRouteRow( *row ) for row in rows ] )
+    return sidetone.SideToneWidget.route_gains( window, volume )
+
+def test_route_gains_add_up_routes_between_the_same_devices() :
+    rows = [ ( 'Mic', 'Phones', 50 ), ( 'Mic', 'Phones', 30 ),
+             ( 'USB', 'Speaker', 100 ), ( 'USB', 'Phones', 20 ) ]
+    gains = route_gains( False, 0.5, rows )
+    assert numpy.allclose( gains, [ [ 1.3, 0.2 ], [ 0.0, 1.0 ] ] )
+
+def test_route_gains_when_muted() :
+    gains = route_gains( True, 0.0, [ ( 'USB', 'Speaker', 100 ) ] )
+    assert gains == [ [ 0.0, 0.0 ], [ 0.0, 0.0 ] ]
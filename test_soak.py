@@ -0,0 +1,59 @@
+'''
+
+Tests of how soak.py judges its samples.
+
+    python3 -m pytest -q
+
+soak.py needs QtMultimedia, and these are skipped without it.
+
+'''
+import pytest
+
+# QtMultimedia can be installed but fail to load its audio libraries.
+pytest.importorskip( 'PyQt5.QtMultimedia', exc_type=ImportError )
+
+from soak import judge
+
+# Samples every 5 seconds for 200 seconds of a run where nothing grows.
+def steady_samples() :
+    return [ { 'secs' : index * 5, 'rss' : 100000, 'objects' : 50000,
+               'qobjects' : 40, 'devices' : 4, 'fds' : 10, 'glitches' : 3 }
+             for index in range( 40 ) ]
+
+def test_steady_run_passes() :
+    assert judge( steady_samples(), 10 ) == []
+
+def test_noise_within_allowance_passes() :
+    samples = steady_samples()
+    for index, sample in enumerate( samples ) :
+        sample['rss'] += ( index % 3 ) * 1000
+        sample['devices'] += index % 2
+    assert judge( samples, 10 ) == []
+
+@pytest.mark.parametrize( 'metric, step', [
+    ( 'rss', 500 ), ( 'objects', 200 ), ( 'qobjects', 1 ),
+    ( 'devices', 1 ), ( 'fds', 1 )
+] )
+def test_growth_fails( metric, step ) :
+    samples = steady_samples()
+    for index, sample in enumerate( samples ) :
+        sample[ metric ] += index * step
+    failures = judge( samples, 10 )
+    assert len( failures ) == 1
+    assert failures[0].startswith( metric + ' grew' )
+
+def test_glitches_coming_faster_fails() :
+    samples = steady_samples()
+    for index, sample in enumerate( samples ) :
+        sample['glitches'] += index * index
+    assert judge( samples, 10 )[0].startswith( 'glitches rose' )
+
+def test_warmup_is_ignored() :
+    samples = steady_samples()
+    for sample in samples[ : 4 ] :
+        sample['objects'] = 1000
+    assert judge( samples, 20 ) == []
+
+def test_too_few_samples() :
+    assert judge( steady_samples()[ : 5 ], 10 ) == [
+        'too few samples after the warm-up to judge' ]
@@ -0,0 +1,154 @@
+'''
+
+Tests of vad.py: what the VoiceDucker takes for a voice, how long it
+holds the gain up, and how the gain ramps.
+
+    python3 -m pytest -q
+
+'''
+import numpy
+import pytest
+
+from relay import Block
+from vad import ATTACK_MS, RELEASE_MS, VoiceDucker
+
+RATE = 48000
+FRAMES = 106
+
+def ducker( level=0.5, hangover_ms=300, channels=1 ) :
+    ducker = VoiceDucker( threshold_db=-45, hangover_ms=hangover_ms )
+    ducker.configure( RATE, channels )
+    ducker.enabled = True
+    ducker.level = level
+    return ducker
+
+def block_of( samples, channels=1 ) :
+    block = Block( FRAMES * channels * 2, numpy.int16 )
+    block.samples[:] = numpy.repeat( samples, channels )
+    return block
+
+# A steady value, which never crosses zero: a voice if loud enough. At
+# 3200 it is about -20 dBFS, at 100 about -50.
+def steady( value, channels=1 ) :
+    return block_of( numpy.full( FRAMES, value ), channels )
+
+# Noise, which crosses zero about every other sample, at about the given
+# level in dBFS.
+def hiss( db, seed=1 ) :
+    noise = numpy.random.default_rng( seed ).normal(
+        0, 32768 * 10 ** ( db / 20 ), FRAMES )
+    return block_of( noise.clip( -32768, 32767 ) )
+
+# A low tone, which crosses zero seldom, at about the given level.
+def tone( db ) :
+    amplitude = 32768 * 10 ** ( db / 20 ) * 2 ** 0.5
+    return block_of( amplitude * numpy.sin( numpy.arange( FRAMES ) * 0.05 ) )
+
+def test_disabled_passes_blocks_untouched() :
+    duck = ducker()
+    duck.enabled = False
+    block = tone( -20 )
+    before = block.samples.copy()
+    assert duck.stage( block ) is block
+    assert ( block.samples == before ).all()
+
+@pytest.mark.parametrize( 'block, speaking', [
+    ( tone( -30 ), True ),
+    ( tone( -50 ), False ),
+    ( hiss( -35 ), False ),
+    ( hiss( -20 ), True ),
+    ( steady( 0 ), False ),
+], ids=[ 'voice', 'quiet voice', 'hiss', 'loud hiss', 'silence' ] )
+def test_what_is_a_voice( block, speaking ) :
+    duck = ducker()
+    duck.stage( block )
+    assert duck.speaking == speaking
+
+def test_threshold() :
+    duck = ducker()
+    duck.set_threshold( -20 )
+    duck.stage( tone( -30 ) )
+    assert not duck.speaking
+
+def test_hangover_in_blocks() :
+    duck = ducker( hangover_ms=10 )
+    duck.stage( steady( 3200 ) )
+    # 10 ms is 4.5 blocks of 106 frames at 48 kHz.
+    assert duck.hangover_blocks == 5
+    speaking = []
+    for i in range( 6 ) :
+        duck.stage( hiss( -35 ) )
+        speaking.append( duck.speaking )
+    assert speaking == [ True ] * 4 + [ False ] * 2
+
+def test_hangover_is_at_least_one_block() :
+    duck = ducker( hangover_ms=0 )
+    duck.stage( steady( 3200 ) )
+    assert duck.hangover_blocks == 1
+    assert duck.speaking
+    duck.stage( hiss( -35 ) )
+    assert not duck.speaking
+
+def test_set_hangover_after_blocks() :
+    duck = ducker()
+    duck.stage( steady( 3200 ) )
+    duck.set_hangover( 100 )
+    assert duck.hangover_blocks == round( 100 * RATE / 1000 / FRAMES )
+
+def gains( block, value ) :
+    return block.samples.astype( float ) / value
+
+def test_attack_ramps_up_to_the_level() :
+    duck = ducker( level=0.5 )
+    ramp = gains( duck.stage( steady( 3200 ) ), 3200 )
+    step = 1000.0 / ( ATTACK_MS * RATE )
+    assert ramp[0] == pytest.approx( step, abs=1 / 3200 )
+    assert ( numpy.diff( ramp ) >= 0 ).all()
+    assert ramp.max() <= 0.5
+    assert ramp[-1] == pytest.approx( 0.5, abs=1 / 3200 )
+    assert duck.gain == pytest.approx( 0.5 )
+
+def test_release_ramps_down_to_silence() :
+    duck = ducker( level=0.5, hangover_ms=0 )
+    duck.stage( steady( 3200 ) )
+    # Quiet, so not a voice, but still there to see the gain on.
+    ramp = gains( duck.stage( steady( 100 ) ), 100 )
+    step = 1000.0 / ( RELEASE_MS * RATE )
+    assert ( numpy.diff( ramp ) <= 0 ).all()
+    assert duck.gain == pytest.approx( 0.5 - FRAMES * step )
+    for i in range( 100 ) :
+        duck.stage( steady( 100 ) )
+    assert duck.gain == 0.0
+    assert ( duck.stage( steady( 100 ) ).samples == 0 ).all()
+
+def test_steady_gain_below_one_scales() :
+    duck = ducker( level=0.5 )
+    duck.stage( steady( 3200 ) )
+    assert ( duck.stage( steady( 3200 ) ).samples == 1600 ).all()
+
+def test_full_gain_passes_blocks_untouched() :
+    duck = ducker( level=1.0 )
+    duck.stage( steady( 3200 ) )
+    assert duck.gain == 1.0
+    block = tone( -3 )
+    before = block.samples.copy()
+    assert duck.stage( block ) is block
+    assert ( block.samples == before ).all()
+
+def test_stereo_judged_on_first_channel_and_ducked_on_both() :
+    duck = ducker( level=0.5, channels=2 )
+    block = steady( 3200, channels=2 )
+    block.samples[ 1 : : 2 ] = 1000
+    duck.stage( block )
+    assert duck.speaking
+    last = block.samples.reshape( -1, 2 )[-1]
+    assert list( last ) == [ 1600, 500 ]
+
+def test_new_block_size() :
+    duck = ducker()
+    duck.stage( steady( 3200 ) )
+    block = Block( 2 * FRAMES * 2, numpy.int16 )
+    block.samples[:] = 3200
+    duck.stage( block )
+    assert duck.frames == 2 * FRAMES
+    assert duck.speaking
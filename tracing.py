@@ -0,0 +1,142 @@
+'''
+
+Low-overhead tracing of the audio path, saved as Chrome trace-event JSON
+that can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+A BlockTracer exists only while tracing is turned on. Code in the audio
+path keeps a reference to it that is None when tracing is off, so the
+whole cost of the disabled case is one "is None" test per block.
+
+Events are stored as plain tuples in a bounded deque, so a trace left
+running for a long time keeps only the most recent events instead of
+eating memory. An event's arguments are plain values in its tuple, named
+by a tuple of names the caller writes as a constant, so no dict is made
+per event. They are turned into JSON only when the trace is saved, one
+event at a time.
+
+Besides the audio blocks and GUI slots that call it, the tracer hooks
+gc.callbacks so that Python garbage collections show up on the same
+timeline as the audio blocks they delay.
+
+'''
+import functools
+import gc
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Maximum number of events retained. A block costs about six events, so
+# at the 450 blocks a second of a planned 48 kHz mono block this is about
+# two minutes of history, in some 40 MB.
+MAX_EVENTS = 300000
+
+class BlockTracer( object ) :
+    def __init__( self, max_events=MAX_EVENTS ) :
+        # Each event is (name, category, start, end, arg_names, *values)
+        # with start and end from time.perf_counter(). An end of None is
+        # an instant event.
+        self.events = deque( maxlen=max_events )
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        # Zero point for timestamps in the saved file.
+        self.origin = time.perf_counter()
+        # Start time of a garbage collection in progress.
+        self.gc_start = None
+
+    # The clock used for all events; callers use it to take the start
+    # time of a span, then pass it to complete().
+    now = staticmethod( time.perf_counter )
+
+    # Record a span of time from start to end (default now), with
+    # arguments given as a tuple of their names and then their values,
+    # e.g. complete( 'read', 'io', start, end, ( 'bytes', ), count ).
+    def complete( self, name, category, start, end=None, arg_names=(),
+                  *values ) :
+        if end is None :
+            end = time.perf_counter()
+        self.events.append( ( name, category, start, end, arg_names ) + values )
+
+    # Record a point in time, for example a device state change.
+    def instant( self, name, category, arg_names=(), *values ) :
+        self.events.append(
+            ( name, category, time.perf_counter(), None, arg_names ) + values
+        )
+
+    # Begin and end watching the garbage collector.
+    def start( self ) :
+        gc.callbacks.append( self._gc_callback )
+
+    def stop( self ) :
+        if self._gc_callback in gc.callbacks :
+            gc.callbacks.remove( self._gc_callback )
+
+    def _gc_callback( self, phase, info ) :
+        if phase == 'start' :
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None :
+            self.complete(
+                'gc gen {}'.format( info['generation'] ), 'gc',
+                self.gc_start, None, ( 'collected', ), info['collected']
+            )
+            self.gc_start = None
+
+    # Convert the events to the Chrome trace-event format, one at a time.
+    # Timestamps and durations in that format are in microseconds.
+    def trace_events( self ) :
+        origin = self.origin
+        yield {
+            'name' : 'thread_name', 'ph' : 'M',
+            'pid' : self.pid, 'tid' : self.tid,
+            'args' : { 'name' : 'Qt main thread' }
+        }
+        for ( name, category, start, end, arg_names, *values ) \
+                in list( self.events ) :
+            event = {
+                'name' : name, 'cat' : category,
+                'ts' : ( start - origin ) * 1e6,
+                'pid' : self.pid, 'tid' : self.tid
+            }
+            if end is None :
+                event['ph'] = 'i'
+                event['s'] = 't'
+            else :
+                event['ph'] = 'X'
+                event['dur'] = ( end - start ) * 1e6
+            if arg_names :
+                event['args'] = dict( zip( arg_names, values ) )
+            yield event
+
+    # Write the trace to a file, returning the number of events written.
+    # The events are written as they are converted, so that saving a full
+    # trace does not make a second copy of it.
+    def save( self, path ) :
+        count = 0
+        with open( path, 'w' ) as trace_file :
+            trace_file.write( '{"displayTimeUnit": "ms", "traceEvents": [\n' )
+            for event in self.trace_events() :
+                if count :
+                    trace_file.write( ',\n' )
+                trace_file.write( json.dumps( event ) )
+                count += 1
+            trace_file.write( '\n]}\n' )
+        return count
+
+# Decorator for slots of an object that has a "tracer" member. When the
+# tracer is not None the time spent in the slot is recorded under the
+# "gui" category with the name of the method.
+
+def traced_slot( method ) :
+    name = method.__name__
+    @functools.wraps( method )
+    def wrapper( self, *args ) :
+        tracer = self.tracer
+        if tracer is None :
+            return method( self, *args )
+        start = tracer.now()
+        try :
+            return method( self, *args )
+        finally :
+            tracer.complete( name, 'gui', start )
+    return wrapper
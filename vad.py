@@ -0,0 +1,180 @@
+'''
+
+Duck the sidetone in the gaps between words.
+
+Operators want to hear their own voice at full level while they talk,
+but not the hiss of the mic in between. A VoiceDucker is a relay stage
+that decides, block by block, whether the input holds speech, and ramps
+the gain of the block smoothly toward the volume while it does, and
+toward silence when it has not for a while.
+
+The detector is the classic pair of energy and zero-crossing rate,
+taken on the first channel of each block:
+
+  * the block's level, mean square of samples scaled to +/-1.0, must be
+    above a threshold; and
+  * its zero-crossing rate must be below ZCR_MAX, as voiced speech has
+    far fewer zero crossings than hiss, unless the level is LOUD_DB over
+    the threshold, which lets through loud unvoiced sounds like "s".
+
+Once speech is seen the gain stays up for a hangover time, so the gaps
+inside and between words are not ducked. The gain rises over ATTACK_MS
+and falls over RELEASE_MS.
+
+The decision is made on the block itself and applied to that same
+block, so there is no look-ahead and no added delay; at worst the first
+ATTACK_MS of a word is faded in. All the work is a few NumPy passes over
+one block into arrays made once, so the time per block is bounded and
+small.
+
+'''
+import math
+
+import numpy
+
+# Defaults: level threshold in dBFS, hangover in ms.
+THRESHOLD_DB = -45
+HANGOVER_MS = 300
+
+# Fraction of sample pairs that cross zero, above which a block is noise.
+ZCR_MAX = 0.25
+
+# A block this many dB over the threshold is speech whatever its ZCR.
+LOUD_DB = 20
+
+# Time for the gain to rise to the volume, and to fall to silence.
+ATTACK_MS = 2.0
+RELEASE_MS = 80.0
+
+class VoiceDucker( object ) :
+    def __init__( self, threshold_db=THRESHOLD_DB, hangover_ms=HANGOVER_MS ) :
+        # When False, the stage passes blocks through untouched.
+        self.enabled = False
+        # The gain while speaking, 0.0 to 1.0, set from the volume slider.
+        self.level = 0.0
+        self.set_threshold( threshold_db )
+        self.hangover_ms = hangover_ms
+        self.hangover_blocks = 1
+        # The gain applied at the end of the last block.
+        self.gain = 0.0
+        # Blocks of hangover left; above 0 counts as speech.
+        self.hangover = 0
+        # Whether the last block was judged speech, for display.
+        self.speaking = False
+        self.configure( 48000, 1 )
+
+    def set_threshold( self, threshold_db ) :
+        self.threshold_db = threshold_db
+        self.threshold_power = numpy.array(
+            10.0 ** ( threshold_db / 10.0 ), dtype=numpy.float32 )
+        self.loud_power = numpy.array(
+            10.0 ** ( ( threshold_db + LOUD_DB ) / 10.0 ), dtype=numpy.float32 )
+
+    def set_hangover( self, hangover_ms ) :
+        self.hangover_ms = hangover_ms
+        if self.frames :
+            self.hangover_blocks = max(
+                1, round( hangover_ms * self.rate / 1000.0 / self.frames ) )
+
+    # Set the sample rate and channel count of the blocks to come.
+    def configure( self, rate, channels ) :
+        self.rate = rate
+        self.channels = channels
+        self.attack_step = 1.0 / max( 1.0, ATTACK_MS * rate / 1000.0 )
+        self.release_step = 1.0 / max( 1.0, RELEASE_MS * rate / 1000.0 )
+        # Arrays are made for the first block, and again if the size changes.
+        self.frames = 0
+
+    # Make the arrays for blocks of this many frames. Every number used on
+    # a block is an array made here too, because a Python number passed to
+    # NumPy becomes a new array, and a cast through a buffer, every time.
+
+    def make_arrays( self, frames ) :
+        self.frames = frames
+        # Views of each block seen, as frames and as its first channel.
+        self.views = {}
+        self.first = numpy.zeros( frames, dtype=numpy.float32 )
+        # Scaling samples by this makes their sum of squares the mean
+        # square of samples at +/-1.0.
+        self.sample_scale = numpy.array(
+            1.0 / ( 32768 * frames ** 0.5 ), dtype=numpy.float32 )
+        self.power = numpy.zeros( (), dtype=numpy.float32 )
+        self.over_threshold = numpy.zeros( (), dtype=bool )
+        self.over_loud = numpy.zeros( (), dtype=bool )
+        self.signs = numpy.zeros( frames, dtype=bool )
+        self.signs_after = self.signs[ 1 : ]
+        self.signs_before = self.signs[ : -1 ]
+        self.crossings = numpy.zeros( frames - 1, dtype=bool )
+        # As an int, since comparing the int count to a float is not free.
+        self.max_crossings = math.ceil( ZCR_MAX * frames )
+        steps = numpy.arange( 1, frames + 1, dtype=numpy.float32 )
+        self.attack_steps = steps * numpy.float32( self.attack_step )
+        self.release_steps = steps * numpy.float32( -self.release_step )
+        self.ramp = numpy.zeros( ( frames, 1 ), dtype=numpy.float32 )
+        self.ramp_column = self.ramp[ :, 0 ]
+        self.gain_now = numpy.zeros( (), dtype=numpy.float32 )
+        self.gain_target = numpy.zeros( (), dtype=numpy.float32 )
+        self.scaled = numpy.zeros( ( frames, self.channels ), dtype=numpy.float32 )
+        self.set_hangover( self.hangover_ms )
+
+    # Make or find the views of a block: the relay has only a few blocks.
+    def block_views( self, block ) :
+        views = self.views.get( block )
+        if views is None :
+            frames_view = block.samples.reshape( -1, self.channels )
+            views = ( frames_view, frames_view[ :, 0 ] )
+            self.views[ block ] = views
+        return views
+
+    # Relay stage: judge the block, then apply the gain ramp to it.
+
+    def stage( self, block ) :
+        if not self.enabled :
+            return block
+        if block.samples.shape[0] != self.frames * self.channels :
+            self.make_arrays( block.samples.shape[0] // self.channels )
+        frames_view, first_channel = self.block_views( block )
+
+        # Level and zero-crossing rate of the first channel.
+        first = self.first
+        numpy.copyto( first, first_channel )
+        numpy.multiply( first, self.sample_scale, out=first )
+        numpy.dot( first, first, out=self.power )
+        numpy.greater( self.power, self.threshold_power, out=self.over_threshold )
+        numpy.greater( self.power, self.loud_power, out=self.over_loud )
+        numpy.signbit( first, out=self.signs )
+        numpy.not_equal( self.signs_after, self.signs_before,
+                         out=self.crossings )
+        crossings = numpy.count_nonzero( self.crossings )
+        if self.over_loud \
+           or ( self.over_threshold and crossings < self.max_crossings ) :
+            self.hangover = self.hangover_blocks
+        elif self.hangover > 0 :
+            self.hangover -= 1
+        self.speaking = self.hangover > 0
+
+        # Ramp the gain from where it was toward the target, and apply it.
+        target = self.level if self.speaking else 0.0
+        gain = self.gain
+        scaled = self.scaled
+        if gain == target :
+            if gain == 1.0 :
+                return block
+            self.gain_now[()] = gain
+            numpy.copyto( scaled, frames_view )
+            numpy.multiply( scaled, self.gain_now, out=scaled )
+        else :
+            ramp = self.ramp_column
+            self.gain_now[()] = gain
+            self.gain_target[()] = target
+            if target > gain :
+                numpy.add( self.attack_steps, self.gain_now, out=ramp )
+                numpy.minimum( ramp, self.gain_target, out=ramp )
+            else :
+                numpy.add( self.release_steps, self.gain_now, out=ramp )
+                numpy.maximum( ramp, self.gain_target, out=ramp )
+            self.gain = float( ramp[-1] )
+            numpy.copyto( scaled, frames_view )
+            numpy.multiply( scaled, self.ramp, out=scaled )
+        numpy.copyto( frames_view, scaled, casting='unsafe' )
+        return block